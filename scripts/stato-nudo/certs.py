@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Certificati X.509 analizzati in locale, dopo un handshake senza verifica.
+- fingerprint(): SHA-256 del DER, per riconoscere lo stesso certificato su piu' domini
+- parse(): issuer, subject, notAfter e SAN nello stesso formato di getpeercert()
+- verify(): verifica offline della catena contro il trust store di sistema
+  (o di certifi, se il sistema non ha CA), con le regole di un client HTTPS
+  (nome, scadenza, uso della chiave)
+Richiede cryptography >= 42.
+"""
+
+import hashlib
+import os
+import ssl
+import threading
+import warnings
+from datetime import datetime, timezone
+
+from cryptography import x509
+from cryptography.x509.verification import PolicyBuilder, Store, VerificationError
+
+# Nomi degli attributi come li restituisce getpeercert()
+ATTRIBUTE_NAMES = {
+    x509.NameOID.COMMON_NAME: 'commonName',
+    x509.NameOID.ORGANIZATION_NAME: 'organizationName',
+    x509.NameOID.ORGANIZATIONAL_UNIT_NAME: 'organizationalUnitName',
+    x509.NameOID.COUNTRY_NAME: 'countryName',
+    x509.NameOID.STATE_OR_PROVINCE_NAME: 'stateOrProvinceName',
+    x509.NameOID.LOCALITY_NAME: 'localityName',
+    x509.NameOID.EMAIL_ADDRESS: 'emailAddress',
+    x509.NameOID.SERIAL_NUMBER: 'serialNumber',
+}
+
+NO_TRUST_STORE = 'no_trust_store'    # verify() senza nessuna CA caricata
+
+_store = None
+_store_loaded = False
+_store_lock = threading.Lock()
+
+
+def _load_pem(path, certs):
+    """Un certificato alla volta: una CA malformata nel bundle non scarta le altre."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return
+    end = b'-----END CERTIFICATE-----'
+    for block in data.split(end)[:-1]:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                certs.append(x509.load_pem_x509_certificate(block + end))
+        except ValueError:
+            pass
+
+
+def _system_cas(certs):
+    paths = ssl.get_default_verify_paths()
+    if paths.cafile:
+        _load_pem(paths.cafile, certs)
+    elif paths.capath and os.path.isdir(paths.capath):
+        for name in sorted(os.listdir(paths.capath)):
+            _load_pem(os.path.join(paths.capath, name), certs)
+
+
+def trust_store():
+    """
+    Le CA di sistema (cafile/capath di OpenSSL), caricate una volta per
+    processo; senza, quelle di certifi se installato. None se non ce ne sono
+    (Store([]) non esiste): la scansione parte lo stesso e verify() da'
+    NO_TRUST_STORE.
+    """
+    global _store, _store_loaded
+    if _store_loaded:
+        return _store
+    with _store_lock:
+        if not _store_loaded:
+            certs = []
+            _system_cas(certs)
+            if not certs:
+                try:
+                    import certifi
+                    _load_pem(certifi.where(), certs)
+                except ImportError:
+                    pass
+            if certs:
+                _store = Store(certs)
+            else:
+                print('Nessuna CA di sistema ne\' certifi: i certificati non verranno '
+                      f'verificati ({NO_TRUST_STORE})', flush=True)
+            _store_loaded = True
+    return _store
+
+
+def peer_chain(ssock):
+    """Catena DER presentata dal server, foglia per prima, anche senza verifica."""
+    try:
+        chain = ssock._sslobj.get_unverified_chain() or []   # Python >= 3.10
+        return [c.public_bytes(ssl._ssl.ENCODING_DER) for c in chain]
+    except AttributeError:
+        der = ssock.getpeercert(binary_form=True)
+        return [der] if der else []
+
+
+def fingerprint(der):
+    """SHA-256 del certificato DER in esadecimale: la chiave della tabella certificati."""
+    return hashlib.sha256(der).hexdigest()
+
+
+def _name(name):
+    return tuple(((ATTRIBUTE_NAMES.get(a.oid, a.oid.dotted_string), a.value),)
+                 for a in name)
+
+
+def parse(der):
+    """Il certificato foglia come getpeercert(); dict vuoto se il DER e' illeggibile."""
+    try:
+        cert = x509.load_der_x509_certificate(der)
+        not_after = cert.not_valid_after_utc
+        info = {
+            'issuer': _name(cert.issuer),
+            'subject': _name(cert.subject),
+            # stesso formato di OpenSSL: 'Jun  1 12:00:00 2025 GMT'
+            'notAfter': f'{not_after:%b} {not_after.day:2d} {not_after:%H:%M:%S %Y} GMT',
+        }
+    except ValueError:
+        return {}
+
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    except (x509.ExtensionNotFound, ValueError):
+        return info
+    info['subjectAltName'] = (
+        tuple(('DNS', n) for n in san.get_values_for_type(x509.DNSName))
+        + tuple(('IP Address', str(ip)) for ip in san.get_values_for_type(x509.IPAddress))
+    )
+    return info
+
+
+def verify(chain, hostname, store=None):
+    """
+    Verifica offline di `chain` (DER, foglia per prima) per `hostname`, contro
+    `store` o, di default, trust_store(). Ritorna '' se valida, altrimenti il
+    motivo del rifiuto.
+    """
+    if not chain:
+        return 'no_certificate'
+    store = store or trust_store()
+    if store is None:
+        return NO_TRUST_STORE
+    try:
+        leaf = x509.load_der_x509_certificate(chain[0])
+        intermediates = [x509.load_der_x509_certificate(d) for d in chain[1:]]
+        verifier = (PolicyBuilder()
+                    .store(store)
+                    .time(datetime.now(timezone.utc))
+                    .build_server_verifier(x509.DNSName(hostname)))
+        verifier.verify(leaf, intermediates)
+    except (VerificationError, ValueError) as e:
+        # il repr del certificato in coda non serve nel CSV
+        return str(e).split(' (encountered processing')[0][:200] or 'invalid'
+    return ''
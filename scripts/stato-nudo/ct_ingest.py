@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+SAN dai log di Certificate Transparency, da dump locali.
+Il server live mostra un solo certificato; nei log CT ci sono tutti quelli
+emessi. I dump (JSON Lines, anche .gz: una voce per riga, formato certstream
+data.leaf_cert.all_domains oppure piatto con all_domains/dns_names) vengono
+letti in streaming, una riga alla volta: la memoria non dipende dalla
+dimensione del dump.
+- filtro veloce: le righe senza nessun TLD dei domini PA non vengono
+  nemmeno decodificate
+- indice dei suffissi (domains.DomainIndex): ogni SAN viene attribuito al
+  dominio PA piu' specifico di cui e' sottodominio scendendo il trie delle
+  etichette (niente confronto con ogni dominio)
+merge affianca i SAN da CT a quelli dei certificati live (cert_san_results.csv
+e cert_index.csv di scan_cert_san, formato csv). Per i certificati con piu'
+di scan_cert_san.SAN_LIMIT nomi (san_names troncato, live_truncated) sono
+ct_only solo i SAN CT che in ordine cadono dentro la parte salvata.
+
+Uso:
+  python ct_ingest.py ingest dump1.jsonl.gz dump2.jsonl ...   -> ct_san_index.csv
+  python ct_ingest.py merge                                   -> cert_san_merged.csv
+"""
+
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+
+import domains
+import scan_cert_san
+import scan_tls
+
+# --- Configurazione ---
+CT_INDEX = os.path.join(os.path.dirname(__file__), 'output', 'ct_san_index.csv')
+MERGED   = os.path.join(os.path.dirname(__file__), 'output', 'cert_san_merged.csv')
+PROGRESS = 1_000_000     # righe per riga di progresso
+# ----------------------
+
+FIELDNAMES = ['domain', 'san', 'fingerprint', 'not_after']
+
+MERGED_FIELDNAMES = [
+    'domain', 'live_san_count', 'live_truncated', 'ct_san_count', 'ct_only_count', 'ct_only_names'
+]
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def entry_cert(entry):
+    """La parte 'certificato' di una voce: certstream (data.leaf_cert) o piatta."""
+    cert = entry.get('data', entry)
+    if isinstance(cert, dict):
+        cert = cert.get('leaf_cert', cert)
+    return cert if isinstance(cert, dict) else {}
+
+
+def entry_names(cert):
+    for key in ('all_domains', 'dns_names', 'domains', 'san'):
+        names = cert.get(key)
+        if names:
+            return [n for n in names if isinstance(n, str)]
+    return []
+
+
+def load_index():
+    """Coppie (dominio, SAN) gia' in CT_INDEX, per non riscriverle a ogni dump."""
+    seen = set()
+    if os.path.exists(CT_INDEX):
+        with open(CT_INDEX, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                seen.add((row['domain'], row['san']))
+    return seen
+
+
+def ingest(paths):
+    # serve solo l'attribuzione ai domini PA, non il dominio registrabile
+    index = domains.DomainIndex(scan_tls.load_domains(), psl_path=None)
+    # filtro sulle righe grezze: '.it"' compare solo se un nome finisce in .it
+    needles = sorted('.' + tld + '"' for tld in index.tlds)
+    seen = load_index()
+    new_file = not os.path.exists(CT_INDEX) or os.path.getsize(CT_INDEX) == 0
+
+    with open(CT_INDEX, 'a', newline='', encoding='utf-8') as out:
+        writer = csv.DictWriter(out, fieldnames=FIELDNAMES)
+        if new_file:
+            writer.writeheader()
+
+        for path in paths:
+            start = time.monotonic()
+            lines = parsed = added = 0
+            with _open(path) as f:
+                for line in f:
+                    lines += 1
+                    if lines % PROGRESS == 0:
+                        print(f'  {path}: {lines} righe | decodificate: {parsed} | nuovi SAN: {added}')
+                    if not any(n in line for n in needles):
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    parsed += 1
+                    cert = entry_cert(entry)
+                    for name in entry_names(cert):
+                        domain = index.pa_domain(name)
+                        if not domain:
+                            continue
+                        san = name.lower().rstrip('.')
+                        if (domain, san) in seen:
+                            continue
+                        seen.add((domain, san))
+                        writer.writerow({
+                            'domain': domain,
+                            'san': san,
+                            'fingerprint': cert.get('fingerprint') or cert.get('sha256') or '',
+                            'not_after': cert.get('not_after', ''),
+                        })
+                        added += 1
+            out.flush()
+            elapsed = time.monotonic() - start
+            print(f'{path}: {lines} righe in {elapsed:.1f}s | decodificate: {parsed} | nuovi SAN: {added}')
+
+
+def merge():
+    """SAN visti nei log CT accanto a quelli del certificato live (cert_index)."""
+    ct = {}
+    with open(CT_INDEX, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            ct.setdefault(row['domain'], set()).add(row['san'])
+
+    cert_sans = {}
+    if os.path.exists(scan_cert_san.CERTS_OUTPUT):
+        with open(scan_cert_san.CERTS_OUTPUT, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                names = row['san_names'].split(' | ') if row['san_names'] else []
+                cert_sans[row['fingerprint']] = (int(row['san_count'] or 0), set(names))
+
+    live = {}
+    if os.path.exists(scan_cert_san.OUTPUT):
+        with open(scan_cert_san.OUTPUT, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row.get('cert_fingerprint') in cert_sans:
+                    live[row['domain']] = cert_sans[row['cert_fingerprint']]
+
+    with open(MERGED, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=MERGED_FIELDNAMES)
+        writer.writeheader()
+        for domain in sorted(set(ct) | set(live)):
+            live_count, live_names = live.get(domain, (0, set()))
+            ct_names = ct.get(domain, set())
+            ct_only = sorted(ct_names - live_names)
+            truncated = live_count > len(live_names)
+            if truncated:
+                # san_names ha i primi SAN_LIMIT nomi in ordine: oltre l'ultimo non si sa
+                last = max(live_names, default='')
+                ct_only = [n for n in ct_only if n < last]
+            writer.writerow({
+                'domain': domain,
+                'live_san_count': live_count,
+                'live_truncated': truncated,
+                'ct_san_count': len(ct_names),
+                'ct_only_count': len(ct_only),
+                'ct_only_names': ' | '.join(ct_only[:50]),
+            })
+    print(f'{MERGED}: {len(set(ct) | set(live))} domini, {len(ct)} con SAN da CT')
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('ingest', 'merge'):
+        sys.exit(__doc__)
+    if sys.argv[1] == 'ingest':
+        if len(sys.argv) < 3:
+            sys.exit(__doc__)
+        ingest(sys.argv[2:])
+    else:
+        merge()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Resolver DNS condiviso da tutti gli scanner stato-nudo.
+- un solo dns.resolver.Resolver per processo (resolv.conf letto una volta)
+- cache LRU che rispetta il TTL delle risposte
+- cache negativa per NXDOMAIN/NoAnswer (TTL dal SOA, altrimenti NEGATIVE_TTL)
+- exists(): il nome esiste? (NXDOMAIN o no, RFC 8020), in cache come le query
+- query identiche in volo contemporaneamente escono in rete una volta sola
+- cache su disco (SQLite) condivisa tra esecuzioni: dopo un crash le risposte
+  ancora valide non vengono richieste di nuovo (--refresh-dns per ignorarla)
+Timeout ed errori di rete non vengono messi in cache.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import dns.rdatatype
+import dns.resolver
+
+# --- Configurazione ---
+MAXSIZE      = 100_000   # risposte in cache
+NEGATIVE_TTL = 300       # secondi, se la risposta negativa non ha SOA
+DISK_CACHE   = os.path.join(os.path.dirname(__file__), 'output', 'dns_cache.sqlite')
+# ----------------------
+
+# Tipi interrogati sul dominio stesso dagli scanner DNS (per remaining())
+RDTYPES = ('A', 'AAAA', 'MX', 'TXT', 'NS', 'SOA', 'CAA', 'DNSKEY', 'DS')
+# Pseudo-tipo di exists(): risposta ['NXDOMAIN'] o ['NOERROR'], in cache come le altre
+EXISTS = 'EXISTS'
+
+
+class _InFlight:
+    """Query in corso: chi arriva dopo aspetta l'evento invece di rifarla."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.answers = []
+        self.error = None
+
+
+def negative_ttl(e, default=NEGATIVE_TTL):
+    """TTL di una risposta negativa: min(TTL, MINIMUM) del SOA in authority."""
+    try:
+        if isinstance(e, dns.resolver.NXDOMAIN):
+            responses = list(e.responses().values())
+        else:
+            responses = [e.response()]
+        for response in responses:
+            for rrset in response.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    return min(rrset.ttl, rrset[0].minimum)
+    except Exception:
+        pass
+    return default
+
+
+class DiskCache:
+    """Risposte DNS su SQLite, chiave (qname, rdtype), scadenza in epoch."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS answers ('
+            ' qname TEXT, rdtype TEXT, expires REAL, answers TEXT,'
+            ' PRIMARY KEY (qname, rdtype))'
+        )
+        self.conn.execute('DELETE FROM answers WHERE expires < ?', (time.time(),))
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Ritorna (ttl residuo, risposte) oppure None se assente o scaduta.
+        Errori di SQLite (es. 'database is locked' con piu' scanner sullo
+        stesso file) valgono come assente: la query va in rete.
+        """
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    'SELECT expires, answers FROM answers WHERE qname = ? AND rdtype = ?', key
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        ttl = row[0] - time.time()
+        if ttl <= 0:
+            return None
+        return ttl, json.loads(row[1])
+
+    def put(self, key, ttl, answers):
+        """Salva una risposta; se SQLite fallisce resta solo nella cache in memoria."""
+        try:
+            with self._lock:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)',
+                    (*key, time.time() + ttl, json.dumps(answers)),
+                )
+                self.conn.commit()
+        except sqlite3.Error:
+            with self._lock:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+
+
+class CachingResolver:
+    """Resolver thread-safe con cache TTL/LRU e coalescenza delle query."""
+
+    def __init__(self, timeout, maxsize=MAXSIZE, disk=None, refresh=False):
+        self.resolver = dns.resolver.Resolver()
+        self.resolver.timeout = timeout
+        self.resolver.lifetime = timeout
+        self.maxsize = maxsize
+        self._cache = OrderedDict()   # (qname, rdtype) -> (scadenza, risposte)
+        self._inflight = {}           # (qname, rdtype) -> _InFlight
+        self._lock = threading.Lock()
+        self.disk = disk              # DiskCache o None
+        self.refresh = refresh        # True: non leggere dal disco, solo scrivere
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _resolve(self, qname, rdtype):
+        """Query in rete. Ritorna (risposte, ttl); ttl 0 = non cacheabile."""
+        if rdtype == EXISTS:
+            return self._exists(qname)
+        try:
+            answers = self.resolver.resolve(qname, rdtype)
+            return [str(r) for r in answers], answers.rrset.ttl
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            return [], negative_ttl(e)
+        except Exception:
+            return [], 0
+
+    def _exists(self, qname):
+        try:
+            answers = self.resolver.resolve(qname, 'TXT')
+            return ['NOERROR'], answers.rrset.ttl
+        except dns.resolver.NXDOMAIN as e:
+            return ['NXDOMAIN'], negative_ttl(e)
+        except dns.resolver.NoAnswer as e:
+            return ['NOERROR'], negative_ttl(e)     # esiste, senza TXT (anche nodo vuoto)
+        except Exception:
+            return [], 0
+
+    def exists(self, qname):
+        """
+        False solo se qname non esiste (NXDOMAIN): per RFC 8020 allora non
+        esiste nessun nome sotto. True anche senza record o se la query fallisce.
+        """
+        return self.query(qname, EXISTS) != ['NXDOMAIN']
+
+    def query(self, qname, rdtype):
+        """Come il vecchio dns_query(): lista di stringhe o lista vuota."""
+        key = (qname.lower().rstrip('.'), rdtype.upper())
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return list(entry[1])
+                del self._cache[key]
+
+            flight = self._inflight.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._inflight[key] = _InFlight()
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return list(flight.answers)
+
+        # qualunque cosa succeda, la query esce da _inflight e chi aspetta viene
+        # svegliato: altrimenti ogni query successiva per key resterebbe bloccata
+        stored = None
+        answers, ttl = [], 0
+        try:
+            if self.disk is not None and not self.refresh:
+                stored = self.disk.get(key)
+            if stored is not None:
+                ttl, answers = stored
+            else:
+                answers, ttl = self._resolve(*key)
+                if ttl > 0 and self.disk is not None:
+                    self.disk.put(key, ttl, answers)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    if stored is not None:
+                        self.disk_hits += 1
+                    else:
+                        self.misses += 1
+                    if ttl > 0:
+                        self._cache[key] = (time.monotonic() + ttl, answers)
+                        if len(self._cache) > self.maxsize:
+                            self._cache.popitem(last=False)
+                del self._inflight[key]
+            flight.answers = answers
+            flight.event.set()
+        return list(answers)
+
+    def remaining(self, qname, rdtypes=RDTYPES):
+        """TTL residuo minimo (secondi) delle risposte in cache per qname; 0 se nessuna."""
+        now = time.monotonic()
+        qname = qname.lower().rstrip('.')
+        with self._lock:
+            left = [self._cache[(qname, t)][0] - now for t in rdtypes if (qname, t) in self._cache]
+        return max(0.0, min(left)) if left else 0.0
+
+    def stats(self):
+        return (f'cache DNS hit/miss: {self.hits}/{self.misses} '
+                f'(disco: {self.disk_hits}, coalesce: {self.coalesced})')
+
+
+_shared = None
+_shared_lock = threading.Lock()
+_config = {'disk': DISK_CACHE, 'refresh': False}
+
+
+def add_arguments(parser):
+    parser.add_argument('--refresh-dns', action='store_true',
+                        help='ignora la cache DNS su disco (le nuove risposte vengono salvate)')
+    parser.add_argument('--no-dns-cache', action='store_true',
+                        help='non usare la cache DNS su disco')
+
+
+def configure(args):
+    """Applica le opzioni di add_arguments(); va chiamata prima di shared()."""
+    _config['refresh'] = args.refresh_dns
+    if args.no_dns_cache:
+        _config['disk'] = None
+
+
+def shared(timeout):
+    """Il resolver di processo; `timeout` conta solo alla prima chiamata."""
+    global _shared
+    if _shared is not None:
+        return _shared      # percorso di ogni query: niente lock
+    with _shared_lock:
+        if _shared is None:
+            disk = None
+            if _config['disk']:
+                os.makedirs(os.path.dirname(_config['disk']), exist_ok=True)
+                try:
+                    disk = DiskCache(_config['disk'])
+                except sqlite3.Error as e:
+                    print(f"cache DNS su disco non disponibile ({e}): solo in memoria", flush=True)
+            _shared = CachingResolver(timeout, disk=disk, refresh=_config['refresh'])
+    return _shared
+
+
+def ip_targets(domain, timeout):
+    """Chiavi di rate limit per gli scanner TLS/HTTP: gli IPv4 del dominio."""
+    return ['ip:' + ip for ip in shared(timeout).query(domain, 'A')]
+
+
+def ns_targets(domain, timeout):
+    """Chiavi di rate limit per gli scanner DNS: i nameserver autoritativi."""
+    return ['ns:' + ns.lower().rstrip('.') for ns in shared(timeout).query(domain, 'NS')]
+
+
+def remaining(domain):
+    """TTL residuo delle risposte gia' viste per domain (schedule.Recorder)."""
+    return _shared.remaining(domain) if _shared else 0.0
+
+
+def stats():
+    return _shared.stats() if _shared else 'cache DNS: inattiva'
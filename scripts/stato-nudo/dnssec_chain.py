@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Validazione DNSSEC lungo la catena delle deleghe.
+Per ogni dominio:
+- DS chiesto direttamente ai nameserver della zona padre (non al resolver)
+- digest del DS confrontato con le DNSKEY del dominio
+- firma RRSIG del DS con le chiavi del padre, e delle DNSKEY con la chiave
+  indicata dal DS, con la finestra di validita' (inception/expiration)
+- algoritmi delle chiavi e dei digest, segnalando quelli deprecati
+Le zone padre (la radice, it, gov.it...) vengono trovate, interrogate e
+validate fino all'ancora della radice una volta per esecuzione, e condivise da
+tutti i domini: per dominio restano una query DS e una DNSKEY.
+Le DNSKEY passano dal resolver con CD (checking disabled): anche i dati che un
+resolver validante scarterebbe arrivano qui e vengono giudicati in locale.
+Richiede dnspython con cryptography (pip install dnspython[dnssec]).
+"""
+
+import threading
+import time
+
+import dns.dnssec
+import dns.flags
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+
+import dnscache
+
+# --- Configurazione ---
+TIMEOUT = 5
+SERVERS = 3          # nameserver della zona padre provati per una query DS
+# Ancore di fiducia della radice (KSK-2017 e KSK-2024), come DS:
+# https://data.iana.org/root-anchors/root-anchors.xml
+ROOT_ANCHORS = [
+    '20326 8 2 E06D44B80B8F1D39A95C0B0D7C65D08458E880409BBC683457104237C7F8EC8D',
+    '38696 8 2 683D2D0ACB8C9B712A1948B27F741219298D0A450D612C483AF444A4C0FB2B16',
+]
+# ----------------------
+
+# RSAMD5, DH, DSA, RSASHA1, DSA-NSEC3-SHA1, RSASHA1-NSEC3-SHA1, ECC-GOST (RFC 8624)
+DEPRECATED = {1, 2, 3, 5, 6, 7, 12}
+
+_resolver = None
+_zones = {}          # dns.name.Name -> dict di _build_zone()
+_enclosing = {}      # dns.name.Name -> zona che lo contiene
+_locks = {}
+_lock = threading.Lock()
+
+
+def resolver():
+    """Resolver con DO e CD: risposte con le RRSIG, senza filtri di validazione."""
+    global _resolver
+    if _resolver is not None:
+        return _resolver
+    with _lock:
+        if _resolver is None:
+            r = dns.resolver.Resolver()
+            r.timeout = r.lifetime = TIMEOUT
+            r.use_edns(0, dns.flags.DO, 1232)
+            r.flags = dns.flags.RD | dns.flags.CD
+            _resolver = r
+    return _resolver
+
+
+def _memo(table, key, compute):
+    """table[key], calcolato una volta sola anche con piu' thread; gli errori non restano."""
+    if key in table:
+        return table[key]
+    with _lock:
+        lock = _locks.setdefault((id(table), key), threading.Lock())
+    with lock:
+        if key not in table:
+            table[key] = compute(key)
+    return table[key]
+
+
+def _recursive(name, rdtype):
+    """Risposta completa del resolver; None per NXDOMAIN."""
+    try:
+        return resolver().resolve(name, rdtype, raise_on_no_answer=False).response
+    except dns.resolver.NXDOMAIN:
+        return None
+
+
+def _find(response, name, rdtype):
+    """(rrset, rrsig) di name/rdtype nella sezione answer; None dove mancano."""
+    rrset = sig = None
+    for r in response.answer if response is not None else []:
+        if r.name != name:
+            continue
+        if r.rdtype == rdtype:
+            rrset = r
+        elif r.rdtype == dns.rdatatype.RRSIG and r.covers == rdtype:
+            sig = r
+    return rrset, sig
+
+
+def _zone_of(name):
+    """La zona che contiene `name`: dalla SOA in answer (apice) o in authority."""
+    if name == dns.name.root:
+        return name
+    try:
+        response = resolver().resolve(name, dns.rdatatype.SOA, raise_on_no_answer=False).response
+        responses = [response]
+    except dns.resolver.NXDOMAIN as e:
+        responses = list(e.responses().values())
+    for response in responses:
+        for r in response.answer + response.authority:
+            if r.rdtype == dns.rdatatype.SOA:
+                return r.name
+    return name.parent()
+
+
+def _servers(zone):
+    """Qualche IPv4 dei nameserver autoritativi della zona (dalla cache condivisa)."""
+    cache = dnscache.shared(TIMEOUT)
+    ips = []
+    for ns in sorted(cache.query(zone.to_text(omit_final_dot=True), 'NS')):
+        ips += cache.query(ns, 'A')[:1]
+        if len(ips) >= SERVERS:
+            break
+    return ips
+
+
+def _ds_from_parent(name, parent):
+    """(DS, RRSIG) di name dai nameserver della zona padre; dal resolver se non ce ne sono."""
+    if not parent['servers']:
+        return _find(_recursive(name, dns.rdatatype.DS), name, dns.rdatatype.DS)
+    query = dns.message.make_query(name, dns.rdatatype.DS, want_dnssec=True)
+    error = None
+    # ogni dominio parte da un server diverso: il carico si divide tra i nameserver del padre
+    start = hash(name) % len(parent['servers'])
+    for ip in parent['servers'][start:] + parent['servers'][:start]:
+        try:
+            response = dns.query.udp(query, ip, timeout=TIMEOUT)
+            if response.flags & dns.flags.TC:
+                response = dns.query.tcp(query, ip, timeout=TIMEOUT)
+        except Exception as e:
+            error = e
+            continue
+        if response.rcode() not in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+            error = RuntimeError(f'{ip}: {dns.rcode.to_text(response.rcode())}')
+            continue
+        return _find(response, name, dns.rdatatype.DS)
+    raise error
+
+
+def _ds_matches(name, key, ds):
+    if ds.key_tag != dns.dnssec.key_id(key) or ds.algorithm != key.algorithm:
+        return False
+    try:
+        return dns.dnssec.make_ds(name, key, ds.digest_type) == ds
+    except (dns.dnssec.UnsupportedAlgorithm, ValueError):
+        return False
+
+
+def _window(sigs, now):
+    """Motivo se nessuna firma e' nella sua finestra di validita', altrimenti ''."""
+    if all(s.expiration < now for s in sigs):
+        return 'RRSIG scaduta'
+    if all(s.inception > now for s in sigs):
+        return 'RRSIG non ancora valida'
+    return ''
+
+
+def _check(name, parent):
+    """
+    Verifica la delega di `name` dalla zona `parent` (None: la radice,
+    confrontata con ROOT_ANCHORS). Lo status e':
+      secure   - DS del padre firmato, corrispondente a una DNSKEY che firma le DNSKEY
+      insecure - nessun DS nel padre (zona non firmata o non delegata in modo sicuro)
+      island   - DNSKEY pubblicate ma nessun DS nel padre
+      bogus    - catena presente ma rotta (motivo in 'reason')
+    """
+    out = {'status': 'bogus', 'ds_match': False, 'rrsig_valid': False, 'rrsig_days_left': '',
+           'algorithms': '', 'ds_digest_types': '', 'weak_algorithm': False, 'reason': '',
+           'dnskey': None}
+    if parent is None:
+        ds = dns.rrset.from_text_list(name, 0, 'IN', 'DS', ROOT_ANCHORS)
+        ds_sig = None
+    else:
+        ds, ds_sig = _ds_from_parent(name, parent)
+    dnskey, key_sig = _find(_recursive(name, dns.rdatatype.DNSKEY), name, dns.rdatatype.DNSKEY)
+    out['dnskey'] = dnskey
+
+    algorithms = {k.algorithm for k in dnskey} if dnskey else set()
+    out['algorithms'] = ' | '.join(sorted(dns.dnssec.algorithm_to_text(a) for a in algorithms))
+    out['weak_algorithm'] = bool(algorithms & DEPRECATED)
+    if ds:
+        out['ds_digest_types'] = ' | '.join(sorted({dns.dnssec.DSDigest(d.digest_type).name
+                                                    if d.digest_type in (1, 2, 4) else str(d.digest_type)
+                                                    for d in ds}))
+
+    if not ds:
+        out['status'] = 'island' if dnskey else 'insecure'
+        return out
+    if not dnskey:
+        out['reason'] = 'DS nel padre ma nessuna DNSKEY'
+        return out
+
+    now = time.time()
+    if parent is not None:
+        if ds_sig is None or parent['dnskey'] is None:
+            out['reason'] = 'DS senza firma del padre'
+            return out
+        try:
+            dns.dnssec.validate(ds, ds_sig, {parent['name']: parent['dnskey']}, now=now)
+        except (dns.dnssec.ValidationFailure, dns.dnssec.UnsupportedAlgorithm) as e:
+            out['reason'] = _window(ds_sig, now) or f'RRSIG del DS: {e}'
+            return out
+
+    matched = [k for k in dnskey if any(_ds_matches(name, k, d) for d in ds)]
+    out['ds_match'] = bool(matched)
+    if not matched:
+        out['reason'] = 'nessuna DNSKEY corrisponde al DS'
+        return out
+    if key_sig is None:
+        out['reason'] = 'DNSKEY senza RRSIG'
+        return out
+
+    out['rrsig_days_left'] = int((max(s.expiration for s in key_sig) - now) // 86400)
+    trusted = dns.rrset.from_rdata_list(name, dnskey.ttl, matched)
+    try:
+        dns.dnssec.validate(dnskey, key_sig, {name: trusted}, now=now)
+    except dns.dnssec.UnsupportedAlgorithm:
+        # RFC 4035 5.2: algoritmo sconosciuto al validatore -> trattato come non firmato
+        out['status'], out['reason'] = 'insecure', 'algoritmo non supportato'
+        return out
+    except dns.dnssec.ValidationFailure as e:
+        out['reason'] = _window(key_sig, now) or f'RRSIG delle DNSKEY: {e}'
+        return out
+    out['rrsig_valid'] = True
+    out['status'] = 'secure'
+    return out
+
+
+def zone(name):
+    """Una zona padre, validata una volta per esecuzione: name, dnskey, servers, secure."""
+    return _memo(_zones, name, _build_zone)
+
+
+def _build_zone(name):
+    if name == dns.name.root:
+        check, chain, servers = _check(name, None), True, []
+    else:
+        parent = zone(_memo(_enclosing, name.parent(), _zone_of))
+        check, chain, servers = _check(name, parent), parent['secure'], _servers(name)
+    return {'name': name, 'dnskey': check['dnskey'], 'servers': servers,
+            'secure': chain and check['status'] == 'secure'}
+
+
+def validate(domain):
+    """
+    Esito della validazione di `domain`: status (vedi _check), motivo,
+    dettagli di DS/DNSKEY/RRSIG, zona padre e chain_secure (anche tutte le
+    zone sopra, fino alla radice, sono valide). Errori di rete: status
+    'indeterminate'.
+    """
+    out = {'status': 'indeterminate', 'parent_zone': '', 'chain_secure': False}
+    try:
+        name = dns.name.from_text(domain)
+        parent_name = _memo(_enclosing, name.parent(), _zone_of)
+        out['parent_zone'] = parent_name.to_text(omit_final_dot=True) or '.'
+        parent = zone(parent_name)
+        check = _check(name, parent)
+    except Exception as e:
+        out['reason'] = str(e)[:200] or type(e).__name__
+        return out
+    del check['dnskey']
+    out.update(check)
+    out['chain_secure'] = parent['secure'] and check['status'] == 'secure'
+    return out
+
+
+def stats():
+    secure = sum(1 for z in _zones.values() if z['secure'])
+    return f'zone padre validate: {len(_zones)} ({secure} sicure)'
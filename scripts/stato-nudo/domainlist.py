@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Lista dei domini da scansionare, letta in streaming.
+- sorgente: pa_metadati.csv (colonna 'domain'), un file di testo con un
+  dominio per riga, anche .gz, oppure '-' per stdin
+- normalizzazione: minuscolo, niente punto finale ne' schema/percorso,
+  'www.' tolto (www.comune.x.it e comune.x.it sono lo stesso ente),
+  nomi Unicode in IDNA (punycode)
+- validazione: etichette di 1-63 caratteri [a-z0-9-], senza '-' ai bordi,
+  almeno due etichette, TLD non numerico, al massimo 253 caratteri
+I domini escono uno alla volta, nell'ordine della sorgente e senza duplicati:
+la lista non viene mai materializzata (resta solo l'insieme dei gia' visti).
+Con --shard i/N ogni macchina prende solo i domini del suo shard (jump
+consistent hash: passando da N a N+1 shard si sposta solo 1/(N+1) dei domini)
+e scrive su file propri (<nome>.shard-i-of-N.csv), da riunire con
+python store.py merge.
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import os
+import re
+import sys
+
+LABEL = re.compile(r'^[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?$')
+
+
+def add_arguments(parser):
+    parser.add_argument('--domains', metavar='FILE',
+                        help="domini da scansionare: CSV con colonna 'domain' o un dominio "
+                             "per riga, anche .gz; '-' = stdin (default: pa_metadati.csv)")
+    parser.add_argument('--keep-www', action='store_true',
+                        help="non togliere il prefisso 'www.' dai domini")
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help='scansiona solo lo shard i di N (1 <= i <= N), su file propri')
+
+
+def parse_shard(value):
+    """'2/4' -> (2, 4)"""
+    try:
+        i, n = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'shard non valido: {value} (formato i/N)')
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f'shard non valido: {value} (serve 1 <= i <= N)')
+    return i, n
+
+
+def shard_of(domain, n):
+    """Shard (1..n) di `domain`: jump consistent hash (Lamping-Veach) su blake2b."""
+    key = int.from_bytes(hashlib.blake2b(domain.encode(), digest_size=8).digest(), 'big')
+    b, j = -1, 0
+    while j < n:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b + 1
+
+
+def shard_path(path, shard):
+    """output/tls_results.csv -> output/tls_results.shard-2-of-4.csv (invariato senza shard)."""
+    if not shard:
+        return path
+    base, ext = os.path.splitext(path)
+    return f'{base}.shard-{shard[0]}-of-{shard[1]}{ext}'
+
+
+def normalize(name, keep_www=False):
+    """Forma canonica di `name`, oppure '' se non e' un nome di dominio valido."""
+    name = name.strip().lower()
+    if '://' in name:
+        name = name.split('://', 1)[1]
+    name = name.split('/', 1)[0].split(':', 1)[0].rstrip('.')
+    if not keep_www and name.startswith('www.'):
+        name = name[4:]
+    if not name.isascii():
+        try:
+            name = name.encode('idna').decode('ascii')
+        except UnicodeError:
+            return ''
+    if len(name) > 253:
+        return ''
+    labels = name.split('.')
+    if len(labels) < 2 or labels[-1].isdigit():
+        return ''
+    if not all(LABEL.match(label) for label in labels):
+        return ''
+    return name
+
+
+def _open(source):
+    if source == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig')
+    if source.endswith('.gz'):
+        return gzip.open(source, 'rt', encoding='utf-8-sig')
+    return open(source, 'r', encoding='utf-8-sig')
+
+
+def _raw(f):
+    """Valori grezzi: colonna 'domain' se la prima riga e' un'intestazione CSV, altrimenti righe."""
+    first = f.readline()
+    if 'domain' in next(csv.reader([first]), []):
+        reader = csv.DictReader(f, fieldnames=next(csv.reader([first])))
+        for row in reader:
+            yield row.get('domain') or ''
+    else:
+        yield first
+        yield from f
+
+
+def iter_domains(source, keep_www=False, shard=None):
+    """Domini normalizzati e unici di `source`, uno alla volta; solo quelli di `shard` (i, N)."""
+    seen = set()
+    with _open(source) as f:
+        for raw in _raw(f):
+            d = normalize(raw, keep_www)
+            if not d or d in seen:
+                continue
+            seen.add(d)
+            if shard and shard_of(d, shard[1]) != shard[0]:
+                continue
+            yield d
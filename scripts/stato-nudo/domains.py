@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Indice dei domini: Public Suffix List + domini PA in un unico trie di
+etichette rovesciate (it -> roma -> comune). Una discesa per nome, O(etichette),
+risponde a entrambe le domande:
+- dominio registrabile (comune.roma.it, non roma.it: 'roma.it' e' un suffisso
+  pubblico), per capire se un SAN appartiene a un altro soggetto
+- dominio PA noto piu' specifico di cui il nome e' uguale o sottodominio,
+  per attribuire i SAN agli enti in blocco
+La PSL si legge da PSL_FILE e non e' nel repository: va scaricata una volta
+con python domains.py fetch. Senza il file DomainIndex si ferma: con la sola
+regola implicita '*' (ultime due etichette) www.provincia.roma.it e
+comune.roma.it sembrerebbero lo stesso ente.
+Chi usa solo l'attribuzione ai domini PA (ct_ingest) passa psl_path=None.
+
+Uso da riga di comando:
+  python domains.py fetch    scarica (o aggiorna) PSL_FILE da PSL_URL
+"""
+
+import os
+import sys
+import urllib.request
+
+# --- Configurazione ---
+PSL_FILE = os.path.join(os.path.dirname(__file__), 'public_suffix_list.dat')
+PSL_URL  = 'https://publicsuffix.org/list/public_suffix_list.dat'
+# ----------------------
+
+RULE = 1
+EXCEPTION = 2
+
+
+class _Node:
+    __slots__ = ('children', 'rule', 'pa')
+
+    def __init__(self):
+        self.children = {}
+        self.rule = None     # RULE / EXCEPTION se qui finisce una regola PSL
+        self.pa = None       # dominio PA che finisce qui
+
+
+def _to_ascii(label):
+    """Le regole IDN della PSL in punycode, come compaiono nei certificati."""
+    try:
+        return label.encode('idna').decode('ascii')
+    except UnicodeError:
+        return label
+
+
+def load_psl(path=PSL_FILE):
+    """Regole della PSL (sezioni ICANN e private); path None = nessuna regola."""
+    rules = []
+    if path is None:
+        return rules
+    if not os.path.exists(path):
+        sys.exit(f'{path} non trovato: prima python domains.py fetch')
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('//'):
+                rules.append(line.split()[0].lower())
+    if not rules:
+        sys.exit(f'{path}: nessuna regola, riscaricalo con python domains.py fetch')
+    return rules
+
+
+def fetch(path=PSL_FILE, url=PSL_URL):
+    """Scarica la PSL in `path` (file completo o niente: .tmp e rename)."""
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        data = resp.read()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    print(f'{path}: {len(load_psl(path))} regole')
+
+
+class DomainIndex:
+    """Trie di PSL e domini PA; i nomi vanno passati in minuscolo ASCII (punycode)."""
+
+    def __init__(self, pa_domains=(), psl_path=PSL_FILE):
+        self.root = _Node()
+        for rule in load_psl(psl_path):
+            kind = RULE
+            if rule.startswith('!'):
+                kind, rule = EXCEPTION, rule[1:]
+            self._insert(rule).rule = kind
+        self.pa_domains = set()
+        for d in pa_domains:
+            d = d.lower().rstrip('.')
+            self._insert(d).pa = d
+            self.pa_domains.add(d)
+        self.tlds = {d.rsplit('.', 1)[-1] for d in self.pa_domains}
+
+    def _insert(self, name):
+        node = self.root
+        for label in reversed(name.split('.')):
+            node = node.children.setdefault(_to_ascii(label), _Node())
+        return node
+
+    def lookup(self, name):
+        """(dominio registrabile, dominio PA) di `name`; '' dove non c'e'."""
+        name = name.lower().rstrip('.')
+        if name.startswith('*.'):
+            name = name[2:]
+        labels = name.split('.')
+        labels.reverse()
+
+        suffix = 1           # regola implicita '*': il TLD e' un suffisso pubblico
+        exception = False
+        pa = ''
+        node = self.root
+        for depth, label in enumerate(labels, 1):
+            child = node.children.get(label)
+            if not exception:
+                wild = node.children.get('*')
+                if wild is not None and wild.rule == RULE:
+                    suffix = max(suffix, depth)
+                if child is not None and child.rule == RULE:
+                    suffix = max(suffix, depth)
+                elif child is not None and child.rule == EXCEPTION:
+                    # '!www.ck': www.ck e' registrabile, il suffisso e' ck
+                    suffix = depth - 1
+                    exception = True
+            if child is None:
+                break
+            if child.pa is not None:
+                pa = child.pa
+            node = child
+
+        if len(labels) <= suffix:
+            return '', pa
+        return '.'.join(reversed(labels[:suffix + 1])), pa
+
+    def registrable(self, name):
+        return self.lookup(name)[0]
+
+    def pa_domain(self, name):
+        return self.lookup(name)[1]
+
+    def attribute(self, names):
+        """{dominio PA: [nomi]} per i nomi che cadono sotto un dominio PA noto."""
+        out = {}
+        for name in names:
+            pa = self.lookup(name)[1]
+            if pa:
+                out.setdefault(pa, []).append(name)
+        return out
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'fetch':
+        sys.exit(__doc__)
+    fetch()
+
+
+if __name__ == '__main__':
+    main()
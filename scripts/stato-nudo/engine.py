@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Motore di scansione condiviso per gli scanner stato-nudo.
+Coda di lavoro limitata, alimentata in continuo, servita da N worker asyncio:
+un host lento occupa un solo slot invece di bloccare l'intero batch.
+Le funzioni scan_domain restano sincrone e girano in un pool di thread.
+Ogni risultato passa subito a un unico thread scrittore (Writer), che lo
+accoda al file di output e fa l'fsync ogni FSYNC_EVERY righe.
+La concorrenza parte da WORKERS e si adatta (Controller, AIMD) a timeout,
+reset e latenza osservati, al posto della vecchia pausa fissa tra batch.
+Sopra, un rate limit per IP/nameserver (TargetLimiter) evita di martellare
+lo stesso provider che ospita centinaia di domini PA.
+"""
+
+import asyncio
+import csv
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import schedule
+import store
+
+# --- Configurazione ---
+FSYNC_EVERY    = 50      # righe tra due fsync (0 = solo a fine scansione)
+FSYNC_INTERVAL = 2.0     # secondi massimi senza fsync se arrivano righe
+MAX_FACTOR     = 4       # la concorrenza adattiva arriva fino a WORKERS x MAX_FACTOR
+MIN_WORKERS    = 2
+MIN_WINDOW     = 10      # domini minimi per valutare una finestra
+ERROR_THRESHOLD = 0.15   # quota di timeout/reset oltre cui si dimezza
+LATENCY_FACTOR = 3.0     # latenza mediana oltre cui si dimezza (x la migliore vista)
+LATENCY_FLOOR  = 1.0     # secondi: sotto questa mediana la latenza non fa dimezzare
+TARGET_RATE    = 2.0     # avvii al secondo per singolo IP / nameserver
+TARGET_BURST   = 4       # avvii consecutivi concessi prima di rallentare
+# ----------------------
+
+TRANSIENT_MARKERS = ('timed out', 'timeout', 'connection reset', 'errno 104', 'errno 54')
+
+
+def add_arguments(parser):
+    parser.add_argument('--fsync-every', type=int, default=FSYNC_EVERY, metavar='N',
+                        help=f'fsync ogni N domini completati (default: {FSYNC_EVERY}, 0 = solo alla fine)')
+    parser.add_argument('--fixed-workers', action='store_true',
+                        help='concorrenza fissa a WORKERS, senza adattamento')
+    parser.add_argument('--target-rate', type=float, default=TARGET_RATE, metavar='R',
+                        help=f'domini al secondo per IP/nameserver condiviso '
+                             f'(default: {TARGET_RATE}, 0 = nessun limite)')
+
+
+class Writer:
+    """
+    Unico thread che scrive: i worker non toccano mai i file.
+    `sink` espone write(row), sync() e close() (vedi store).
+    """
+
+    def __init__(self, sink, fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL):
+        self.sink = sink
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='writer', daemon=True)
+        self.thread.start()
+
+    def put(self, row):
+        """Accoda una riga; se il thread scrittore e' gia' fallito rilancia il suo errore."""
+        if self.error:
+            raise self.error
+        self.queue.put(row)
+
+    def _run(self):
+        unsynced = 0
+        last_sync = time.monotonic()
+        try:
+            while True:
+                row = self.queue.get()
+                if row is None:
+                    break
+                self.sink.write(row)
+                unsynced += 1
+                interval = self.fsync_interval and time.monotonic() - last_sync >= self.fsync_interval
+                if (self.fsync_every and unsynced >= self.fsync_every) or interval:
+                    self.sink.sync()
+                    unsynced = 0
+                    last_sync = time.monotonic()
+            self.sink.close()
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        """Scrive quello che resta in coda, fsync e chiude. Rilancia errori di scrittura."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+
+def error_row(domain, e):
+    """Riga minima per un dominio il cui scan ha sollevato un'eccezione."""
+    return {'domain': domain, 'error': str(e)[:200]}
+
+
+def is_transient(row):
+    """Timeout e reset: segnali di sovraccarico (nostro o del bersaglio), non di configurazione."""
+    errors = [row.get('error', '')]
+    errors += [v.get('error', '') for v in row.values() if isinstance(v, dict)]
+    text = ' '.join(str(e) for e in errors if e).lower()
+    return any(m in text for m in TRANSIENT_MARKERS)
+
+
+class Controller:
+    """
+    Concorrenza adattiva AIMD, valutata su finestre di `limit` domini completati:
+    - finestra sana (pochi timeout/reset, latenza mediana stabile) -> limit + 1
+    - troppi errori transitori o latenza > LATENCY_FACTOR x la migliore vista -> limit / 2
+    La latenza serve per gli scanner DNS, dove i timeout diventano risposte vuote.
+    Ogni finestra finisce in `history` e nel log CSV `log`.
+    """
+
+    def __init__(self, initial, maximum, adaptive=True, log=None):
+        self.limit = initial
+        self.maximum = maximum if adaptive else initial
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.cond = asyncio.Condition()
+        self.start = time.monotonic()
+        self.window = []          # (latenza, transitorio)
+        self.best_p50 = None
+        self.history = [initial]  # limite dopo ogni finestra
+        self.backoffs = []        # (secondi, nuovo limite, quota errori, p50)
+        self.log = None
+        if log and adaptive:
+            new = not os.path.exists(log) or os.path.getsize(log) == 0
+            self.log = open(log, 'a', newline='', encoding='utf-8')
+            self.log_writer = csv.writer(self.log)
+            if new:
+                self.log_writer.writerow(['time', 'elapsed_s', 'limit', 'error_rate', 'p50_s'])
+
+    async def acquire(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency, transient):
+        async with self.cond:
+            self.in_flight -= 1
+            if self.adaptive:
+                self.window.append((latency, transient))
+                if len(self.window) >= max(self.limit, MIN_WINDOW):
+                    self._adjust()
+            self.cond.notify_all()
+
+    def _adjust(self):
+        latencies = sorted(lat for lat, _ in self.window)
+        p50 = latencies[len(latencies) // 2]
+        error_rate = sum(1 for _, t in self.window if t) / len(self.window)
+        self.window = []
+
+        slow = (self.best_p50 is not None and p50 > LATENCY_FLOOR
+                and p50 > LATENCY_FACTOR * self.best_p50)
+        elapsed = time.monotonic() - self.start
+        if error_rate > ERROR_THRESHOLD or slow:
+            self.limit = max(MIN_WORKERS, self.limit // 2)
+            self.backoffs.append((elapsed, self.limit, error_rate, p50))
+        elif self.limit < self.maximum:
+            self.limit += 1
+        if self.best_p50 is None or p50 < self.best_p50:
+            self.best_p50 = p50
+
+        self.history.append(self.limit)
+        if self.log:
+            self.log_writer.writerow([time.strftime('%Y-%m-%dT%H:%M:%S'), f'{elapsed:.1f}',
+                                      self.limit, f'{error_rate:.3f}', f'{p50:.3f}'])
+            self.log.flush()
+
+    def close(self):
+        if self.log:
+            self.log.close()
+
+    def describe(self):
+        """Riassunto della concorrenza scelta nel tempo (il dettaglio e' nel log CSV)."""
+        line = (f'iniziale {self.history[0]} | min {min(self.history)} | '
+                f'max {max(self.history)} | finale {self.limit}')
+        if self.backoffs:
+            detail = ', '.join(f'{t:.0f}s->{limit} (err {err:.0%}, p50 {p50:.1f}s)'
+                               for t, limit, err, p50 in self.backoffs[-5:])
+            line += f' | dimezzamenti: {len(self.backoffs)} [{detail}]'
+        return line
+
+
+class TargetLimiter:
+    """
+    Rate limit per infrastruttura condivisa (IP di hosting, nameserver autoritativo).
+    Una chiave concede `rate` avvii al secondo con raffica `burst` (GCRA).
+    reserve() prenota subito lo slot e ritorna quanto aspettare: il dominio
+    viene rinviato senza occupare un worker, che intanto passa al successivo.
+    """
+
+    def __init__(self, rate, burst=TARGET_BURST):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * (burst - 1)
+        self.tat = {}             # chiave -> theoretical arrival time
+        self.deferred = 0
+        self.counts = Counter()   # domini per chiave
+
+    def reserve(self, keys):
+        now = time.monotonic()
+        start = now
+        for k in keys:
+            start = max(start, self.tat.get(k, now) - self.tolerance)
+        for k in keys:
+            self.tat[k] = max(self.tat.get(k, now), start) + self.interval
+            self.counts[k] += 1
+        delay = start - now
+        if delay > 0:
+            self.deferred += 1
+        return delay
+
+    def describe(self):
+        top = ', '.join(f'{k} ({n})' for k, n in self.counts.most_common(5))
+        return f'rinviati: {self.deferred} | chiavi: {len(self.counts)} | piu\' condivise: {top}'
+
+
+async def _producer(queue, results, todo, workers, count):
+    """
+    Passa `todo` (anche un generatore) alla coda limitata, un dominio alla
+    volta: la lista non viene mai materializzata. Alla fine mette None in
+    `results`, e da li' count['produced'] e' il totale.
+    """
+    error = None
+    try:
+        for domain in todo:
+            await queue.put(domain)
+            count['produced'] += 1
+    except asyncio.CancelledError:
+        raise            # annullato da _scan: nessuno aspetta piu' i None
+    except Exception as e:
+        error = e        # sorgente rotta: i domini gia' in coda finiscono comunque
+    for _ in range(workers):
+        await queue.put(None)
+    await results.put(None)
+    if error:
+        raise error
+
+
+async def _process(domain, delay, results, scan_domain, executor, ctl):
+    if delay > 0:
+        await asyncio.sleep(delay)
+    await ctl.acquire()
+    start = time.monotonic()
+    try:
+        r = await asyncio.get_running_loop().run_in_executor(executor, scan_domain, domain)
+    except Exception as e:
+        r = error_row(domain, e)
+    await ctl.release(time.monotonic() - start, is_transient(r))
+    await results.put(r)
+
+
+async def _worker(queue, results, scan_domain, executor, ctl, limiter, targets, deferred, room):
+    """
+    `room` limita i domini presi dalla coda e non ancora finiti, rinviati
+    compresi: senza, i worker svuoterebbero la lista in task addormentati
+    (e in query targets() fatte tutte in anticipo).
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await room.acquire()
+        domain = await queue.get()
+        if domain is None:
+            room.release()
+            return
+        delay = 0.0
+        if limiter:
+            try:
+                keys = await loop.run_in_executor(executor, targets, domain)
+            except Exception:
+                keys = []
+            delay = limiter.reserve(keys)
+        if delay > 0:
+            task = asyncio.create_task(
+                _process(domain, delay, results, scan_domain, executor, ctl))
+            deferred.add(task)
+            task.add_done_callback(deferred.discard)
+            task.add_done_callback(lambda _: room.release())
+        else:
+            try:
+                await _process(domain, 0.0, results, scan_domain, executor, ctl)
+            finally:
+                room.release()
+
+
+async def _scan(todo, scan_domain, emit, summary, workers, batch, adaptive, log,
+                targets, target_rate, total):
+    ctl = Controller(workers, workers * MAX_FACTOR, adaptive, log)
+    limiter = TargetLimiter(target_rate) if targets and target_rate > 0 else None
+    deferred = set()
+    slots = ctl.maximum
+    queue = asyncio.Queue(maxsize=slots * 2)
+    room = asyncio.Semaphore(slots * 2)      # domini in lavorazione o rinviati
+    results = asyncio.Queue()
+
+    try:
+        with ThreadPoolExecutor(max_workers=slots) as executor:
+            count = {'produced': 0}
+            tasks = [asyncio.create_task(_producer(queue, results, todo, slots, count))]
+            tasks += [asyncio.create_task(_worker(queue, results, scan_domain, executor, ctl,
+                                                  limiter, targets, deferred, room))
+                      for _ in range(slots)]
+
+            scanned = 0
+            block = 1
+            recent = []
+            produced = None           # il totale, noto quando il producer ha finito
+            try:
+                while produced is None or scanned < produced:
+                    r = await results.get()
+                    if r is None:
+                        produced = count['produced']
+                    else:
+                        emit(r)
+                        recent.append(r)
+                        scanned += 1
+                    if recent and (len(recent) >= batch or scanned == produced):
+                        line = f'  [{scanned}/{total or produced or "?"}] blocco {block} | conc: {ctl.limit}'
+                        if limiter:
+                            line += f' | rinviati: {limiter.deferred}'
+                        if summary:
+                            line += f' | {summary(recent)}'
+                        print(line, flush=True)
+                        recent = []
+                        block += 1
+            except BaseException:
+                # scrittura fallita (Writer.put rilancia) o Ctrl-C: niente piu' domini,
+                # altrimenti i risultati finirebbero in una coda che nessuno legge
+                for t in tasks + list(deferred):
+                    t.cancel()
+                await asyncio.gather(*tasks, *deferred, return_exceptions=True)
+                raise
+
+            await asyncio.gather(*tasks)
+    finally:
+        ctl.close()
+
+    print()
+    if adaptive:
+        print(f'Concorrenza nel tempo: {ctl.describe()}')
+    if limiter:
+        print(f'Rate limit per IP/NS: {limiter.describe()}')
+    return scanned
+
+
+def run(todo, scan_domain, output, fieldnames, workers, batch=50, summary=None,
+        fmt='csv', fsync_every=FSYNC_EVERY, adaptive=True, targets=None,
+        target_rate=TARGET_RATE, scanner=None, ttl=None, total=None):
+    """
+    Scansiona `todo` partendo da `workers` domini in volo (adattivi, vedi Controller).
+    `todo` puo' essere un generatore (schedule.plan): viene letto man mano che
+    si libera posto in coda; `total`, se noto, serve solo alla riga di progresso.
+    `targets(domain)` ritorna le chiavi dell'infrastruttura condivisa (es. 'ip:...',
+    'ns:...') su cui applicare TargetLimiter; None = nessun limite per bersaglio.
+    Ogni risultato viene accodato a `output` (nel formato `fmt`, vedi store)
+    appena il dominio e' finito; `batch` e' l'intervallo della riga di progresso.
+    `summary(rows)` ritorna la parte specifica dello scanner per la riga di progresso.
+    Con `scanner` ogni riga aggiorna anche lo stato di schedule (`ttl(domain)`
+    per gli scanner DNS).
+    """
+    sink = store.open_store(output, fieldnames, fmt)
+    if scanner:
+        sink = schedule.Recorder(sink, scanner, ttl)
+    log = os.path.splitext(output)[0] + '_concurrency.csv'
+    return run_with(todo, scan_domain, sink, workers, batch, summary, label=sink.path,
+                    fsync_every=fsync_every, adaptive=adaptive, log=log,
+                    targets=targets, target_rate=target_rate, total=total)
+
+
+def run_with(todo, scan_domain, sink, workers, batch=50, summary=None, label='',
+             fsync_every=FSYNC_EVERY, adaptive=True, log=None, targets=None,
+             target_rate=TARGET_RATE, total=None):
+    """Come run(), ma con un sink gia' aperto (es. scan_all che scrive su piu' file)."""
+    if total is None and hasattr(todo, '__len__'):
+        total = len(todo)
+    writer = Writer(sink, fsync_every)
+    start = time.monotonic()
+    try:
+        scanned = asyncio.run(_scan(todo, scan_domain, writer.put, summary, workers, batch,
+                                    adaptive, log, targets, target_rate, total))
+    finally:
+        # anche su Ctrl-C: i risultati gia' arrivati finiscono su disco
+        writer.close()
+    elapsed = time.monotonic() - start
+
+    rate = scanned / elapsed if elapsed > 0 else 0.0
+    print(f'Completo. {scanned} domini in {elapsed:.1f}s ({rate:.2f} domini/s) -> {label}')
+    return scanned
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Indice delle tecnologie dei domini, dai risultati gia' salvati.
+Server, X-Powered-By e nomi dei cookie (headers_results) e issuer del
+certificato (tls_results) diventano coppie (prodotto, versione) normalizzate
+con un insieme di regole compilate una volta, e finiscono in un indice
+invertito prodotto -> versione -> domini (tech_index.json): domande come
+"quali domini hanno ancora PHP 5" si leggono dall'indice, senza rileggere i CSV.
+Le regole girano sui valori distinti di ogni colonna, non sulle righe: poche
+centinaia di stringhe Server diverse per ventimila domini.
+
+Uso:
+  python fingerprint.py build [csv|parquet]   -> tech_index.json
+  python fingerprint.py query PHP [5]         domini con PHP (versione 5.x)
+  python fingerprint.py top [N]               prodotti con piu' domini
+"""
+
+import csv
+import json
+import os
+import re
+import sys
+import time
+
+import scan_headers
+import scan_tls
+import store
+
+# --- Configurazione ---
+INDEX = os.path.join(os.path.dirname(__file__), 'output', 'tech_index.json')
+# ----------------------
+
+# (sorgente, regex, prodotto): il gruppo 'v', se c'e', e' la versione.
+# Su server e powered_by vale ogni regola che compare nel valore
+# ('Apache/2.4.41 (Ubuntu) OpenSSL/1.1.1f PHP/7.4.3' -> tre prodotti); sui
+# cookie la regola deve combaciare dall'inizio del nome; sull'issuer vince la
+# prima, e un issuer senza regola resta col suo nome.
+VERSION = r'(?:[/ ](?P<v>\d+(?:\.\d+)*[a-z]?))?'
+RULES = [
+    ('server', r'\bnginx' + VERSION, 'nginx'),
+    ('server', r'\bopenresty' + VERSION, 'OpenResty'),
+    ('server', r'\bApache(?![-\w])' + VERSION, 'Apache httpd'),
+    ('server', r'\bApache-Coyote' + VERSION, 'Apache Tomcat'),
+    ('server', r'\bMicrosoft-IIS' + VERSION, 'Microsoft IIS'),
+    ('server', r'\bMicrosoft-HTTPAPI' + VERSION, 'Microsoft HTTPAPI'),
+    ('server', r'\bLiteSpeed', 'LiteSpeed'),
+    ('server', r'\bcloudflare', 'Cloudflare'),
+    ('server', r'\bCaddy', 'Caddy'),
+    ('server', r'\bJetty(?:\((?P<v>\d+(?:\.\d+)*))?', 'Jetty'),
+    ('server', r'\bgunicorn' + VERSION, 'gunicorn'),
+    ('server', r'\bAkamaiGHost', 'Akamai'),
+    ('server', r'\bVarnish', 'Varnish'),
+    ('server', r'\bBIG-?IP', 'F5 BIG-IP'),
+    ('server', r'\bawselb', 'AWS ELB'),
+    ('server', r'\bAmazonS3', 'Amazon S3'),
+    ('server', r'\bOracle-(?:HTTP|Application)-Server', 'Oracle HTTP Server'),
+    ('server', r'\bOpenSSL' + VERSION, 'OpenSSL'),
+    ('server', r'\bPHP' + VERSION, 'PHP'),
+    ('server', r'\bmod_perl' + VERSION, 'mod_perl'),
+    ('server', r'\bPhusion[_ ]Passenger' + VERSION, 'Phusion Passenger'),
+    ('powered_by', r'\bPHP' + VERSION, 'PHP'),
+    ('powered_by', r'\bASP\.NET', 'ASP.NET'),
+    ('powered_by', r'\bExpress', 'Express'),
+    ('powered_by', r'\bNext\.js' + VERSION, 'Next.js'),
+    ('powered_by', r'\bServlet' + VERSION, 'Java Servlet'),
+    ('powered_by', r'\bJSP' + VERSION, 'JSP'),
+    ('powered_by', r'\bUndertow' + VERSION, 'Undertow'),
+    ('powered_by', r'\bJBoss', 'JBoss'),
+    ('powered_by', r'\bPlesk', 'Plesk'),
+    ('cookie', r'PHPSESSID$', 'PHP'),
+    ('cookie', r'JSESSIONID$', 'Java Servlet'),
+    ('cookie', r'ASP\.NET_SessionId$', 'ASP.NET'),
+    ('cookie', r'ASPSESSIONID', 'ASP classico'),
+    ('cookie', r'laravel_session$', 'Laravel'),
+    ('cookie', r'ci_session$', 'CodeIgniter'),
+    ('cookie', r'(?:wordpress_|wp-settings-)', 'WordPress'),
+    ('cookie', r'S?SESS[0-9a-f]{32}$', 'Drupal'),
+    ('cookie', r'PrestaShop-', 'PrestaShop'),
+    ('cookie', r'csrftoken$', 'Django'),
+    ('cookie', r'_shibsession_', 'Shibboleth'),
+    ('cookie', r'BIGipServer', 'F5 BIG-IP'),
+    ('cookie', r'TS01[0-9a-f]{6}', 'F5 ASM'),
+    ('cookie', r'AWSALB', 'AWS ELB'),
+    ('cookie', r'__cf_bm$', 'Cloudflare'),
+    ('cookie', r'incap_ses_', 'Imperva'),
+    ('issuer', r"Let's Encrypt", "CA Let's Encrypt"),
+    ('issuer', r'Actalis', 'CA Actalis'),
+    ('issuer', r'Sectigo|COMODO', 'CA Sectigo'),
+    ('issuer', r'DigiCert|GeoTrust|Thawte|RapidSSL', 'CA DigiCert'),
+    ('issuer', r'GlobalSign', 'CA GlobalSign'),
+    ('issuer', r'GoDaddy|Starfield', 'CA GoDaddy'),
+    ('issuer', r'Google Trust Services', 'CA Google'),
+    ('issuer', r'Amazon', 'CA Amazon'),
+    ('issuer', r'Microsoft', 'CA Microsoft'),
+    ('issuer', r'Cloudflare', 'CA Cloudflare'),
+    ('issuer', r'ZeroSSL', 'CA ZeroSSL'),
+    ('issuer', r'Aruba', 'CA Aruba'),
+    ('issuer', r'InfoCert', 'CA InfoCert'),
+    ('issuer', r'Namirial', 'CA Namirial'),
+    ('issuer', r'Entrust', 'CA Entrust'),
+]
+
+# Colonne lette per ogni sorgente: (file di output, colonna)
+SOURCES = {
+    'server': (scan_headers.OUTPUT, 'server'),
+    'powered_by': (scan_headers.OUTPUT, 'powered_by'),
+    'cookie': (scan_headers.OUTPUT, 'cookie_names'),
+    'issuer': (scan_tls.OUTPUT, 'cert_issuer_org'),
+}
+
+
+def compile_rules(rules=RULES):
+    """{sorgente: [(regex compilata, prodotto), ...]}"""
+    compiled = {}
+    for source, pattern, product in rules:
+        compiled.setdefault(source, []).append((re.compile(pattern, re.IGNORECASE), product))
+    return compiled
+
+
+COMPILED = compile_rules()
+
+
+def identify(source, value, compiled=COMPILED):
+    """Coppie (prodotto, versione) di un valore di `source`."""
+    found = []
+    if source == 'cookie':
+        for name in value.split(' | '):
+            for regex, product in compiled['cookie']:
+                if regex.match(name):
+                    found.append((product, ''))
+                    break
+    elif source == 'issuer':
+        for regex, product in compiled['issuer']:
+            if regex.search(value):
+                return [(product, '')]
+        return [('CA ' + value.strip(), '')] if value.strip() else []
+    else:
+        for regex, product in compiled[source]:
+            m = regex.search(value)
+            if m:
+                found.append((product, m.groupdict().get('v') or ''))
+    return found
+
+
+def _column(output, column, fmt):
+    """{dominio: valore} di una colonna dei risultati; per i duplicati vince l'ultima riga."""
+    if fmt == 'parquet':
+        table = store.load_table(output)
+        if table is None or column not in table.column_names:
+            return {}
+        domains = table.column('domain').to_pylist()
+        values = table.column(column).to_pylist()
+        return {d: v or '' for d, v in zip(domains, values)}
+    values = {}
+    if os.path.exists(output):
+        with open(output, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                values[row['domain']] = row.get(column) or ''
+    return values
+
+
+def build(fmt='csv'):
+    """Ricostruisce l'indice invertito da tutti i risultati."""
+    start = time.monotonic()
+    found = {}                  # dominio -> {prodotto: {versioni}}
+    distinct = 0
+    for source, (output, column) in SOURCES.items():
+        by_value = {}
+        for domain, value in _column(output, column, fmt).items():
+            if value:
+                by_value.setdefault(value, []).append(domain)
+        distinct += len(by_value)
+        # le regole una volta per valore distinto, poi il risultato va a tutti i suoi domini
+        for value, domains in by_value.items():
+            for product, version in identify(source, value):
+                for domain in domains:
+                    found.setdefault(domain, {}).setdefault(product, set()).add(version)
+
+    products = {}
+    for domain, seen in found.items():
+        for product, versions in seen.items():
+            if len(versions) > 1:
+                versions.discard('')       # la versione da un'altra sorgente basta
+            for version in versions:
+                products.setdefault(product, {}).setdefault(version, []).append(domain)
+    for versions in products.values():
+        for domains in versions.values():
+            domains.sort()
+
+    os.makedirs(os.path.dirname(INDEX), exist_ok=True)
+    with open(INDEX + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'built': time.strftime('%Y-%m-%d %H:%M:%S'), 'products': products},
+                  f, ensure_ascii=False, sort_keys=True)
+    os.replace(INDEX + '.tmp', INDEX)
+    elapsed = time.monotonic() - start
+    print(f'{INDEX}: {len(products)} prodotti su {len(found)} domini '
+          f'({distinct} valori distinti, {elapsed:.2f}s)')
+
+
+def load_index():
+    if not os.path.exists(INDEX):
+        sys.exit(f'{INDEX} non trovato: prima python fingerprint.py build')
+    with open(INDEX, 'r', encoding='utf-8') as f:
+        return json.load(f)['products']
+
+
+def query(products, product, version=''):
+    """{versione: domini} di `product` (senza maiuscole), solo le versioni `version` o `version`.x."""
+    for name, versions in products.items():
+        if name.lower() == product.lower():
+            return {v: d for v, d in versions.items()
+                    if not version or v == version or v.startswith(version + '.')}
+    return {}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('build', 'query', 'top'):
+        sys.exit(__doc__)
+    command = sys.argv[1]
+    if command == 'build':
+        build(sys.argv[2] if len(sys.argv) > 2 else 'csv')
+    elif command == 'query':
+        if len(sys.argv) < 3:
+            sys.exit(__doc__)
+        found = query(load_index(), sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else '')
+        for version in sorted(found):
+            for domain in found[version]:
+                print(f'{domain}\t{version or "?"}')
+        print(f'{sum(len(d) for d in found.values())} domini', file=sys.stderr)
+    else:
+        limit = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+        products = load_index()
+        counts = {p: len({d for ds in v.values() for d in ds}) for p, v in products.items()}
+        for product, n in sorted(counts.items(), key=lambda x: -x[1])[:limit]:
+            print(f'{n:7d}  {product}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Censimento completo in un solo passaggio: per ogni dominio il lavoro di rete
+(handshake TLS, query DNS) viene fatto una volta sola e i risultati vengono
+smistati nei sei CSV degli scanner singoli, con gli stessi FIELDNAMES.
+- scan_tls + scan_cert_san condividono lo stesso handshake, e scan_headers
+  fa le sue HEAD sulla stessa connessione (keep-alive, vedi webclient)
+- scan_email_auth + scan_dns_extra + scan_dnssec condividono le risposte DNS
+  tramite la cache di processo di dnscache
+Ripresa per scanner: un dominio viene rifatto solo dove manca.
+"""
+
+import argparse
+import os
+
+import dnscache
+import domainlist
+import engine
+import probes
+import scan_cert_san
+import scan_dns_extra
+import scan_dnssec
+import scan_email_auth
+import scan_headers
+import scan_tls
+import schedule
+import store
+import webclient
+
+# --- Configurazione ---
+BATCH    = 50
+TIMEOUT  = 5
+WORKERS  = 25
+CONCURRENCY_LOG = os.path.join(os.path.dirname(__file__), 'output', 'scan_all_concurrency.csv')
+# ----------------------
+
+SCANNERS = {
+    'tls': scan_tls,
+    'cert_san': scan_cert_san,
+    'headers': scan_headers,
+    'email_auth': scan_email_auth,
+    'dns_extra': scan_dns_extra,
+    'dnssec': scan_dnssec,
+}
+TLS_SCANNERS = {'tls', 'cert_san'}
+DNS_SCANNERS = {'email_auth', 'dns_extra', 'dnssec'}
+
+
+def scan_domain(domain, missing):
+    """
+    Esegue solo gli scanner in `missing`, riusando handshake e risposte DNS.
+    Un errore fuori dai singoli scanner (handshake condiviso, rilascio della
+    connessione) da' una riga d'errore a ogni scanner ancora senza riga:
+    CensusSink scrive per scanner, e una riga sola non finirebbe da nessuna parte.
+    """
+    rows = {}
+    hs = None
+    try:
+        if missing & TLS_SCANNERS:
+            hs = probes.tls_handshake(domain, TIMEOUT, keep='headers' in missing)
+        for name in missing:
+            module = SCANNERS[name]
+            try:
+                if name in TLS_SCANNERS or name == 'headers':
+                    rows[name] = module.scan_domain(domain, hs=hs)
+                else:
+                    rows[name] = module.scan_domain(domain)
+            except Exception as e:
+                rows[name] = engine.error_row(domain, e)
+        if hs is not None:
+            probes.release(hs)
+    except Exception as e:
+        for name in missing:
+            rows.setdefault(name, engine.error_row(domain, e))
+    return rows
+
+
+class CensusSink:
+    """Smista ogni risultato di scan_domain() nello store del relativo scanner."""
+
+    def __init__(self, fmt):
+        self.stores = {}
+        for name, module in SCANNERS.items():
+            if name == 'cert_san':
+                # righe per dominio + tabella dei certificati unici
+                sink = scan_cert_san.CertSink(fmt)
+            else:
+                sink = store.open_store(module.OUTPUT, module.FIELDNAMES, fmt)
+            ttl = dnscache.remaining if name in DNS_SCANNERS else None
+            self.stores[name] = schedule.Recorder(sink, name, ttl)
+
+    def write(self, row):
+        for name, sink in self.stores.items():
+            if name in row:
+                sink.write(row[name])
+
+    def sync(self):
+        for sink in self.stores.values():
+            sink.sync()
+
+    def close(self):
+        for sink in self.stores.values():
+            sink.close()
+
+
+def plan(domains, done, args, missing):
+    """
+    Come schedule.plan, per tutti gli scanner in un solo passaggio su `domains`:
+    genera i domini da fare e mette in missing[d] gli scanner da eseguire su d
+    (tolti da scan_domain: restano solo quelli in coda o in volo). Con
+    --rescan, dopo la lista, i domini gia' fatti da tutti gli scanner e
+    scaduti per qualcuno.
+    """
+    present = []
+    for d in domains:
+        names = {name for name in SCANNERS if d not in done[name]}
+        if names:
+            missing[d] = names
+            yield d
+        elif args.rescan:
+            present.append(d)
+    if args.rescan:
+        due = {}
+        for name, module in SCANNERS.items():
+            for d in schedule.rescan(name, present, module.OUTPUT, args):
+                due.setdefault(d, set()).add(name)
+        for d, names in due.items():
+            missing[d] = names
+            yield d
+
+
+def targets(domain):
+    """Rate limit sia per IP (TLS/HTTP) sia per nameserver (DNS)."""
+    return dnscache.ip_targets(domain, TIMEOUT) + dnscache.ns_targets(domain, TIMEOUT)
+
+
+def summarize(results):
+    return f'{dnscache.stats()} | {probes.stats()} | {webclient.stats()}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    engine.add_arguments(parser)
+    store.add_arguments(parser)
+    dnscache.add_arguments(parser)
+    domainlist.add_arguments(parser)
+    schedule.add_arguments(parser)
+    probes.add_arguments(parser)
+    parser.add_argument('--validate-dnssec', action='store_true',
+                        help='scan_dnssec valida la catena DNSSEC (vedi scan_dnssec --validate)')
+    args = parser.parse_args()
+    scan_dnssec.VALIDATE = args.validate_dnssec
+    dnscache.configure(args)
+
+    if args.shard:
+        # ogni scanner sui file del proprio shard
+        for module in SCANNERS.values():
+            module.OUTPUT = domainlist.shard_path(module.OUTPUT, args.shard)
+        scan_cert_san.CERTS_OUTPUT = domainlist.shard_path(scan_cert_san.CERTS_OUTPUT, args.shard)
+    domains = scan_tls.load_domains(args.domains or scan_tls.METADATI, args.keep_www, args.shard)
+    done = {name: module.load_done(args.format) for name, module in SCANNERS.items()}
+    for name in SCANNERS:
+        print(f'Gia\' scansionati {name}: {len(done[name])}')
+    print(f'Batch: {BATCH} | Workers: {WORKERS} (iniziali) | Timeout: {TIMEOUT}s')
+    print()
+
+    scan_cert_san.domain_index()      # PSL subito: se manca ci si ferma prima di scansionare
+    probes.warm(bench_first=args.bench)
+    missing = {}
+    engine.run_with(plan(domains, done, args, missing),
+                    lambda d: scan_domain(d, missing.pop(d)), CensusSink(args.format),
+                    workers=WORKERS, batch=BATCH, summary=summarize,
+                    label=', '.join(SCANNERS), fsync_every=args.fsync_every,
+                    adaptive=not args.fixed_workers,
+                    log=domainlist.shard_path(CONCURRENCY_LOG, args.shard),
+                    targets=targets, target_rate=args.target_rate)
+
+
+if __name__ == '__main__':
+    main()
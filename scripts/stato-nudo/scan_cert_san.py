@@ -3,34 +3,63 @@
 Estrae i Subject Alternative Names (SAN) dai certificati TLS live.
 I SAN rivelano sottodomini, servizi interni e infrastruttura nascosta
 direttamente dal certificato presentato dal server.
+Lo stesso certificato servito da molti domini (hosting condiviso) viene
+classificato una volta e salvato una volta in cert_index.csv, chiave il
+fingerprint SHA-256; le righe per dominio riportano solo il fingerprint e
+i domini estranei (secondo la Public Suffix List, vedi domains) e gli
+altri enti PA che condividono il certificato.
+I SAN sono classificati in un solo passaggio (matcher); altri pattern si
+aggiungono con --patterns file.json ({categoria: [pattern, ...]}). Ogni
+certificato salvato porta l'impronta dei pattern usati (patterns_hash):
+con pattern cambiati viene riclassificato quando si rivede, oppure subito
+con --reclassify (dai san_names salvati).
 Salvataggio incrementale.
 """
 
-import csv
+import argparse
+import hashlib
+import json
 import os
-import socket
-import ssl
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+import certs
+import dnscache
+import domainlist
+import domains
+import engine
+import matcher
+import probes
+import schedule
+import store
 
 # --- Configurazione ---
 METADATI = os.path.join(os.path.dirname(__file__), 'output', 'pa_metadati.csv')
 OUTPUT   = os.path.join(os.path.dirname(__file__), 'output', 'cert_san_results.csv')
+CERTS_OUTPUT = os.path.join(os.path.dirname(__file__), 'output', 'cert_index.csv')
 BATCH    = 50
-SLEEP    = 0.2
 TIMEOUT  = 5
 WORKERS  = 30
+PATTERNS_FILE = os.path.join(os.path.dirname(__file__), 'san_patterns.json')
 # ----------------------
 
+SCANNER = 'cert_san'
+
 FIELDNAMES = [
-    'domain', 'san_count', 'san_names',
+    'domain', 'cert_fingerprint', 'san_count',
+    'other_domains', 'other_domain_count',
+    'other_pa_domains', 'other_pa_count',
+    'error'
+]
+
+# Un certificato per riga, una volta sola anche se servito da piu' domini
+CERT_FIELDNAMES = [
+    'fingerprint', 'san_count', 'san_names',
     'has_wildcard', 'wildcard_names',
     'has_internal', 'internal_names',
     'has_test_dev', 'test_dev_names',
-    'has_mail', 'has_vpn', 'has_admin',
-    'other_domains', 'other_domain_count',
-    'error'
+    'has_mail', 'has_vpn', 'has_admin', 'categories', 'patterns_hash',
 ]
+SAN_LIMIT = 50       # nomi salvati in san_names
 
 # Pattern interessanti nei SAN
 INTERNAL_PATTERNS = ['intranet', 'internal', 'private', 'local', 'lan', 'interno']
@@ -39,180 +68,298 @@ MAIL_PATTERNS = ['mail', 'webmail', 'smtp', 'imap', 'pop', 'posta', 'mx', 'excha
 VPN_PATTERNS = ['vpn', 'remote', 'access', 'gateway', 'gw', 'tunnel']
 ADMIN_PATTERNS = ['admin', 'panel', 'cpanel', 'gestione', 'backoffice', 'cms', 'console']
 
+PATTERNS = {
+    'internal': INTERNAL_PATTERNS,
+    'test_dev': TEST_DEV_PATTERNS,
+    'mail': MAIL_PATTERNS,
+    'vpn': VPN_PATTERNS,
+    'admin': ADMIN_PATTERNS,
+}
+
+
+def load_patterns(path=PATTERNS_FILE):
+    """PATTERNS piu' le categorie/i pattern del file JSON, se esiste."""
+    patterns = {cat: list(pats) for cat, pats in PATTERNS.items()}
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for cat, pats in json.load(f).items():
+                patterns.setdefault(cat, []).extend(pats)
+    return {cat: list(dict.fromkeys(pats)) for cat, pats in patterns.items()}
+
+
+def patterns_hash(patterns):
+    """Impronta breve di {categoria: [pattern, ...]}: cambia con categorie o pattern."""
+    data = json.dumps({cat: sorted(pats) for cat, pats in patterns.items()}, sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()[:12]
+
+
+def set_patterns(path=PATTERNS_FILE):
+    """Pattern di classificazione per tutto il processo (MATCHER e PATTERNS_HASH)."""
+    global MATCHER, PATTERNS_HASH
+    patterns = load_patterns(path)
+    MATCHER = matcher.Matcher(patterns)
+    PATTERNS_HASH = patterns_hash(patterns)
+
+
+MATCHER = PATTERNS_HASH = None
+set_patterns()
+
+
+def load_domains(source=METADATI, keep_www=False, shard=None):
+    """Domini normalizzati e unici di `source` (vedi domainlist), uno alla volta in ordine di lettura."""
+    return domainlist.iter_domains(source, keep_www, shard)
+
+
+def load_done(fmt='csv'):
+    return store.load_done(OUTPUT, fmt)
+
 
-def load_domains():
-    domains = []
-    with open(METADATI, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        seen = set()
-        for row in reader:
-            d = row.get('domain', '').strip()
-            if d and '.' in d and not d.startswith('.') and d not in seen:
-                seen.add(d)
-                domains.append(d)
-    return sorted(domains)
+_index = None
+_index_lock = threading.Lock()
 
 
-def load_done():
-    done = set()
-    if os.path.exists(OUTPUT):
-        with open(OUTPUT, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                done.add(row['domain'])
-    return done
+def domain_index():
+    """domains.DomainIndex di processo (PSL + domini di METADATI), costruito una volta."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            pa = load_domains() if os.path.exists(METADATI) else []
+            _index = domains.DomainIndex(pa)
+    return _index
 
 
 def matches_any(name, patterns):
-    """Controlla se un hostname contiene uno dei pattern."""
+    """Controlla se un hostname contiene uno dei pattern (un giro per categoria, vedi MATCHER)."""
     parts = name.lower().split('.')
     prefix = parts[0] if parts else ''
     return any(p in prefix for p in patterns)
 
 
-def scan_domain(domain):
-    result = {f: '' for f in FIELDNAMES}
-    result['domain'] = domain
+# fingerprint -> (riga di CERT_FIELDNAMES, nomi DNS dei SAN), per tutto il processo
+_classified = {}
+_classified_lock = threading.Lock()
 
-    san_names = set()
 
-    # Prova con verifica
-    for verify in [True, False]:
-        try:
-            ctx = ssl.create_default_context()
-            if not verify:
-                ctx.check_hostname = False
-                ctx.verify_mode = ssl.CERT_NONE
-
-            with socket.create_connection((domain, 443), timeout=TIMEOUT) as sock:
-                with ctx.wrap_socket(sock, server_hostname=domain) as ssock:
-                    cert = ssock.getpeercert()
-                    if cert:
-                        for typ, val in cert.get('subjectAltName', []):
-                            if typ == 'DNS':
-                                san_names.add(val.lower())
-                        break  # successo, non serve fallback
-                    elif verify:
-                        continue  # prova senza verifica
-                    else:
-                        # senza verifica getpeercert() e' vuoto
-                        # prendiamo almeno il cert binario per il CN
-                        der = ssock.getpeercert(binary_form=True)
-                        if der:
-                            result['error'] = 'cert_invalid_no_san_detail'
-                        return result
-        except ssl.SSLCertVerificationError:
-            if verify:
-                continue  # riprova senza verifica
-            result['error'] = 'cert_verify_failed'
-            return result
-        except Exception as e:
-            result['error'] = str(e)[:200]
-            return result
-
-    if not san_names:
-        result['san_count'] = 0
-        return result
+def classify_cert(fingerprint, cert):
+    """Classifica i SAN di un certificato; ogni fingerprint viene analizzato una volta."""
+    with _classified_lock:
+        if fingerprint in _classified:
+            return _classified[fingerprint]
 
-    # Analizza i SAN
-    result['san_count'] = len(san_names)
-    result['san_names'] = ' | '.join(sorted(san_names)[:50])
+    row = {f: '' for f in CERT_FIELDNAMES}
+    row['fingerprint'] = fingerprint
+    row['patterns_hash'] = PATTERNS_HASH
 
-    # Wildcard
-    wildcards = [n for n in san_names if n.startswith('*.')]
-    result['has_wildcard'] = bool(wildcards)
-    if wildcards:
-        result['wildcard_names'] = ' | '.join(sorted(wildcards)[:10])
+    san_names = set()
+    for typ, val in cert.get('subjectAltName', []):
+        if typ == 'DNS':
+            san_names.add(val.lower())
+
+    # Analizza i SAN
+    row['san_count'] = len(san_names)
+    if san_names:
+        row['san_names'] = ' | '.join(sorted(san_names)[:SAN_LIMIT])
+
+        # Wildcard
+        wildcards = [n for n in san_names if n.startswith('*.')]
+        row['has_wildcard'] = bool(wildcards)
+        if wildcards:
+            row['wildcard_names'] = ' | '.join(sorted(wildcards)[:10])
+
+        # Prefisso di ogni nome -> tutte le sue categorie, in un passaggio
+        found = {}
+        for n in san_names:
+            for cat in MATCHER.categories(n.split('.', 1)[0]):
+                found.setdefault(cat, []).append(n)
+
+        # Nomi interni
+        row['has_internal'] = 'internal' in found
+        if 'internal' in found:
+            row['internal_names'] = ' | '.join(sorted(found['internal'])[:10])
+
+        # Test/dev/staging
+        row['has_test_dev'] = 'test_dev' in found
+        if 'test_dev' in found:
+            row['test_dev_names'] = ' | '.join(sorted(found['test_dev'])[:10])
+
+        # Mail, VPN, admin
+        row['has_mail'] = 'mail' in found
+        row['has_vpn'] = 'vpn' in found
+        row['has_admin'] = 'admin' in found
+
+        # Tutte le categorie, comprese quelle di --patterns
+        row['categories'] = ' | '.join(sorted(found))
+
+    entry = (row, frozenset(san_names))
+    with _classified_lock:
+        return _classified.setdefault(fingerprint, entry)
+
+
+def scan_domain(domain, hs=None):
+    """
+    `hs` e' un probes.tls_handshake() gia' eseguito (scan_all), altrimenti lo esegue.
+    La riga del certificato viaggia nella chiave '_cert': la scrive CertSink.
+    """
+    result = {f: '' for f in FIELDNAMES}
+    result['domain'] = domain
 
-    # Nomi interni
-    internal = [n for n in san_names if matches_any(n, INTERNAL_PATTERNS)]
-    result['has_internal'] = bool(internal)
-    if internal:
-        result['internal_names'] = ' | '.join(sorted(internal)[:10])
+    if hs is None:
+        hs = probes.tls_handshake(domain, TIMEOUT)
 
-    # Test/dev/staging
-    test_dev = [n for n in san_names if matches_any(n, TEST_DEV_PATTERNS)]
-    result['has_test_dev'] = bool(test_dev)
-    if test_dev:
-        result['test_dev_names'] = ' | '.join(sorted(test_dev)[:10])
+    if hs['error']:
+        result['error'] = hs['error']
+        return result
 
-    # Mail
-    result['has_mail'] = any(matches_any(n, MAIL_PATTERNS) for n in san_names)
+    if not hs['verified']:
+        # i SAN vengono dalla catena DER, ma il cert non e' valido (o non verificabile)
+        result['error'] = 'cert_invalid' if hs['verify_error'] != certs.NO_TRUST_STORE else certs.NO_TRUST_STORE
 
-    # VPN
-    result['has_vpn'] = any(matches_any(n, VPN_PATTERNS) for n in san_names)
+    if not hs['der']:
+        result['san_count'] = 0
+        return result
 
-    # Admin
-    result['has_admin'] = any(matches_any(n, ADMIN_PATTERNS) for n in san_names)
+    fingerprint = certs.fingerprint(hs['der'])
+    cert_row, san_names = classify_cert(fingerprint, hs['cert'])
+    result['cert_fingerprint'] = fingerprint
+    result['san_count'] = len(san_names)
+    result['_cert'] = cert_row
 
-    # Domini diversi dal principale (cert condiviso = info gratis)
-    base_domain = domain.lower()
+    # Domini diversi dal principale (cert condiviso = info gratis): confronto
+    # sul dominio registrabile secondo la PSL, non sulle ultime due etichette
+    index = domain_index()
+    base = index.registrable(domain)
     other = set()
+    other_pa = set()
     for n in san_names:
         clean = n.lstrip('*.')
-        # Estrai dominio di secondo livello
-        parts = clean.split('.')
-        if len(parts) >= 2:
-            d2 = '.'.join(parts[-2:])
-            if d2 != base_domain and not clean.endswith('.' + base_domain):
-                other.add(clean)
+        registrable, pa = index.lookup(clean)
+        if registrable and registrable != base:
+            other.add(clean)
+            if pa:
+                other_pa.add(pa)
     result['other_domains'] = ' | '.join(sorted(other)[:20])
     result['other_domain_count'] = len(other)
+    # SAN di altri enti PA noti: stesso certificato = stessa infrastruttura
+    result['other_pa_domains'] = ' | '.join(sorted(other_pa)[:20])
+    result['other_pa_count'] = len(other_pa)
 
     return result
 
 
-def main():
-    domains = load_domains()
-    done = load_done()
-    todo = [d for d in domains if d not in done]
+class CertSink:
+    """
+    Righe per dominio in OUTPUT, certificati in CERTS_OUTPUT: un certificato
+    viene scritto la prima volta che compare (anche tra esecuzioni), e di
+    nuovo se era stato classificato con altri pattern (vince l'ultima riga).
+    """
+
+    def __init__(self, fmt='csv'):
+        self.domains = store.open_store(OUTPUT, FIELDNAMES, fmt)
+        self.certs = store.open_store(CERTS_OUTPUT, CERT_FIELDNAMES, fmt, key='fingerprint')
+        # fingerprint -> patterns_hash della riga salvata
+        self.known = {fp: row.get('patterns_hash') or ''
+                      for fp, row in store.load_rows(CERTS_OUTPUT, fmt).items()}
+        self.path = self.domains.path
+
+    def write(self, row):
+        cert = row.get('_cert')
+        if cert and self.known.get(cert['fingerprint']) != cert['patterns_hash']:
+            # prima il certificato: una riga per dominio non resta mai orfana
+            self.known[cert['fingerprint']] = cert['patterns_hash']
+            self.certs.write(cert)
+        self.domains.write({k: v for k, v in row.items() if k != '_cert'})
+
+    def sync(self):
+        self.certs.sync()
+        self.domains.sync()
+
+    def close(self):
+        self.certs.close()
+        self.domains.close()
+
+
+def reclassify(fmt='csv'):
+    """
+    Riclassifica in CERTS_OUTPUT i certificati salvati con pattern diversi
+    dagli attuali, dai loro san_names. Quelli con piu' di SAN_LIMIT nomi
+    (san_names troncato) restano come sono finche' non si rivedono.
+    Ritorna (riclassificati, rimasti).
+    """
+    sink = store.open_store(CERTS_OUTPUT, CERT_FIELDNAMES, fmt, key='fingerprint')
+    done = kept = 0
+    try:
+        for fp, old in store.load_rows(CERTS_OUTPUT, fmt).items():
+            if (old.get('patterns_hash') or '') == PATTERNS_HASH:
+                continue
+            if int(old.get('san_count') or 0) > SAN_LIMIT:
+                kept += 1
+                continue
+            names = old['san_names'].split(' | ') if old.get('san_names') else []
+            row, _ = classify_cert(fp, {'subjectAltName': [('DNS', n) for n in names]})
+            sink.write(row)
+            done += 1
+    finally:
+        sink.close()
+    return done, kept
+
+
+def targets(domain):
+    """Infrastruttura condivisa su cui limitare il ritmo: IP del dominio."""
+    return dnscache.ip_targets(domain, TIMEOUT)
+
+
+def summarize(results):
+    cert_rows = [r['_cert'] for r in results if r.get('_cert')]
+    wc = sum(1 for c in cert_rows if c.get('has_wildcard') == True)
+    td = sum(1 for c in cert_rows if c.get('has_test_dev') == True)
+    ot = sum(1 for r in results if int(r.get('other_domain_count') or 0) > 0)
+    return f'wildcard: {wc} | test/dev: {td} | altri domini: {ot} | cert unici: {len(_classified)}'
+
 
-    total = len(todo)
-    print(f'Totale domini: {len(domains)}')
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    engine.add_arguments(parser)
+    store.add_arguments(parser)
+    dnscache.add_arguments(parser)
+    domainlist.add_arguments(parser)
+    schedule.add_arguments(parser)
+    probes.add_arguments(parser)
+    parser.add_argument('--patterns', default=PATTERNS_FILE,
+                        help='file JSON {categoria: [pattern, ...]} da aggiungere a PATTERNS')
+    parser.add_argument('--reclassify', action='store_true',
+                        help='riclassifica cert_index con i pattern attuali, senza scansionare')
+    args = parser.parse_args()
+    dnscache.configure(args)
+
+    set_patterns(args.patterns)
+
+    if args.shard:
+        global OUTPUT, CERTS_OUTPUT
+        OUTPUT = domainlist.shard_path(OUTPUT, args.shard)
+        CERTS_OUTPUT = domainlist.shard_path(CERTS_OUTPUT, args.shard)
+    if args.reclassify:
+        done, kept = reclassify(args.format)
+        print(f'{CERTS_OUTPUT}: {done} certificati riclassificati, '
+              f'{kept} con piu\' di {SAN_LIMIT} SAN da riclassificare alla prossima scansione')
+        return
+    domains = load_domains(args.domains or METADATI, args.keep_www, args.shard)
+    done = load_done(args.format)
     print(f'Gia\' scansionati: {len(done)}')
-    print(f'Da fare: {total}')
-    print(f'Batch: {BATCH} | Workers: {WORKERS} | Sleep: {SLEEP}s | Timeout: {TIMEOUT}s')
+    todo = schedule.plan(SCANNER, domains, done, OUTPUT, args)   # generatore, letto man mano
+
+    print(f'Batch: {BATCH} | Workers: {WORKERS} (iniziali) | Timeout: {TIMEOUT}s')
     print()
 
-    if not os.path.exists(OUTPUT) or os.path.getsize(OUTPUT) == 0:
-        with open(OUTPUT, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
-
-    scanned = 0
-
-    for i in range(0, total, BATCH):
-        batch = todo[i:i + BATCH]
-        results = []
-
-        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-            futures = {executor.submit(scan_domain, d): d for d in batch}
-            for future in as_completed(futures):
-                domain = futures[future]
-                try:
-                    r = future.result()
-                    results.append(r)
-                except Exception as e:
-                    r = {f: '' for f in FIELDNAMES}
-                    r['domain'] = domain
-                    r['error'] = str(e)[:200]
-                    results.append(r)
-                scanned += 1
-
-        with open(OUTPUT, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            for r in results:
-                writer.writerow(r)
-
-        wc = sum(1 for r in results if r.get('has_wildcard') == True)
-        td = sum(1 for r in results if r.get('has_test_dev') == True)
-        ot = sum(1 for r in results if int(r.get('other_domain_count') or 0) > 0)
-        print(f'  [{scanned}/{total}] batch {i // BATCH + 1} | wildcard: {wc} | test/dev: {td} | altri domini: {ot}')
-
-        if i + BATCH < total:
-            time.sleep(SLEEP)
-
-    print(f'\nCompleto. {scanned} domini -> {OUTPUT}')
+    domain_index()      # PSL subito: se manca ci si ferma prima di scansionare
+    probes.warm(bench_first=args.bench)
+    sink = CertSink(args.format)
+    engine.run_with(todo, scan_domain, schedule.Recorder(sink, SCANNER),
+                    workers=WORKERS, batch=BATCH, summary=summarize,
+                    label=f'{sink.path} + {sink.certs.path}', fsync_every=args.fsync_every,
+                    adaptive=not args.fixed_workers,
+                    log=os.path.splitext(OUTPUT)[0] + '_concurrency.csv',
+                    targets=targets, target_rate=args.target_rate)
 
 
 if __name__ == '__main__':
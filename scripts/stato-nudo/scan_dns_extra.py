@@ -5,25 +5,31 @@ Controlli DNS aggiuntivi per domini PA italiani:
 - CAA record (chi puo' emettere certificati)
 - Wildcard DNS (*.dominio risolve?)
 - SPF permissiveness (analisi profonda del record SPF)
+- SPF espanso: query DNS totali (limite RFC 7208 di 10) e indirizzi autorizzati
 Salvataggio incrementale.
 """
 
-import csv
-import dns.resolver
+import argparse
 import os
 import re
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import dnscache
+import domainlist
+import engine
+import spf_eval
+import schedule
+import store
 
 # --- Configurazione ---
 METADATI = os.path.join(os.path.dirname(__file__), 'output', 'pa_metadati.csv')
 OUTPUT   = os.path.join(os.path.dirname(__file__), 'output', 'dns_extra_results.csv')
 BATCH    = 50
-SLEEP    = 0.2
 TIMEOUT  = 5
 WORKERS  = 40
 # ----------------------
 
+SCANNER = 'dns_extra'
+
 FIELDNAMES = [
     'domain',
     # MX
@@ -36,6 +42,9 @@ FIELDNAMES = [
     'spf_record', 'spf_mechanism_count', 'spf_includes',
     'spf_has_all_pass', 'spf_has_ptr', 'spf_broad_ranges',
     'spf_permissive_score',
+    # SPF espanso
+    'spf_lookup_count', 'spf_over_limit', 'spf_ip4_count', 'spf_ip6_64_count',
+    'spf_expand_error',
     'error'
 ]
 
@@ -64,38 +73,17 @@ MX_PROVIDERS = [
 ]
 
 
-def load_domains():
-    domains = []
-    with open(METADATI, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        seen = set()
-        for row in reader:
-            d = row.get('domain', '').strip()
-            if d and '.' in d and not d.startswith('.') and d not in seen:
-                seen.add(d)
-                domains.append(d)
-    return sorted(domains)
+def load_domains(source=METADATI, keep_www=False, shard=None):
+    """Domini normalizzati e unici di `source` (vedi domainlist), uno alla volta in ordine di lettura."""
+    return domainlist.iter_domains(source, keep_www, shard)
 
 
-def load_done():
-    done = set()
-    if os.path.exists(OUTPUT):
-        with open(OUTPUT, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                done.add(row['domain'])
-    return done
+def load_done(fmt='csv'):
+    return store.load_done(OUTPUT, fmt)
 
 
 def dns_query(qname, rdtype):
-    try:
-        resolver = dns.resolver.Resolver()
-        resolver.timeout = TIMEOUT
-        resolver.lifetime = TIMEOUT
-        answers = resolver.resolve(qname, rdtype)
-        return [str(r) for r in answers]
-    except Exception:
-        return []
+    return dnscache.shared(TIMEOUT).query(qname, rdtype)
 
 
 def identify_mx_provider(mx_records):
@@ -109,7 +97,7 @@ def identify_mx_provider(mx_records):
     return ''
 
 
-def analyze_spf(domain):
+def analyze_spf(domain, query=dns_query):
     """Analisi profonda del record SPF."""
     result = {
         'spf_record': '',
@@ -121,7 +109,7 @@ def analyze_spf(domain):
         'spf_permissive_score': 0,
     }
 
-    txt_records = dns_query(domain, 'TXT')
+    txt_records = query(domain, 'TXT')
     spf = ''
     for t in txt_records:
         t = t.strip('"')
@@ -181,16 +169,24 @@ def analyze_spf(domain):
         score += 1
     result['spf_permissive_score'] = min(score, 5)
 
+    # Espansione ricorsiva (include/redirect/a/mx), memorizzata tra domini
+    expansion = spf_eval.expand(domain, query)
+    result['spf_lookup_count'] = expansion['lookups']
+    result['spf_over_limit'] = expansion['lookups'] > spf_eval.LOOKUP_LIMIT
+    result['spf_ip4_count'] = spf_eval.address_count(expansion['ip4'])
+    result['spf_ip6_64_count'] = spf_eval.subnet_count(expansion['ip6'], 64)
+    result['spf_expand_error'] = expansion['error'][:200]
+
     return result
 
 
-def scan_domain(domain):
+def scan_domain(domain, query=dns_query):
     result = {f: '' for f in FIELDNAMES}
     result['domain'] = domain
 
     try:
         # --- MX ---
-        mx_raw = dns_query(domain, 'MX')
+        mx_raw = query(domain, 'MX')
         mx_hosts = []
         for mx in mx_raw:
             # formato: "10 mail.example.com."
@@ -202,7 +198,7 @@ def scan_domain(domain):
         result['mx_provider'] = identify_mx_provider(mx_hosts)
 
         # --- CAA ---
-        caa_raw = dns_query(domain, 'CAA')
+        caa_raw = query(domain, 'CAA')
         result['has_caa'] = bool(caa_raw)
         if caa_raw:
             issuers = []
@@ -214,13 +210,13 @@ def scan_domain(domain):
             result['caa_issuers'] = ' | '.join(sorted(set(issuers)))
 
         # --- Wildcard DNS ---
-        wildcard = dns_query(f'*.{domain}', 'A')
+        wildcard = query(f'*.{domain}', 'A')
         result['has_wildcard_dns'] = bool(wildcard)
         if wildcard:
             result['wildcard_ip'] = ' | '.join(wildcard[:3])
 
         # --- SPF deep ---
-        spf_result = analyze_spf(domain)
+        spf_result = analyze_spf(domain, query)
         result.update(spf_result)
 
     except Exception as e:
@@ -229,56 +225,48 @@ def scan_domain(domain):
     return result
 
 
-def main():
-    domains = load_domains()
-    done = load_done()
-    todo = [d for d in domains if d not in done]
+def targets(domain):
+    """Infrastruttura condivisa su cui limitare il ritmo: nameserver autoritativi."""
+    return dnscache.ns_targets(domain, TIMEOUT)
 
-    total = len(todo)
-    print(f'Totale domini: {len(domains)}')
+
+def summarize(results):
+    caa = sum(1 for r in results if r.get('has_caa') == True)
+    wc = sum(1 for r in results if r.get('has_wildcard_dns') == True)
+    over = sum(1 for r in results if r.get('spf_over_limit') == True)
+    memo = spf_eval.stats
+    return (f'CAA: {caa} | wildcard: {wc} | SPF >10 lookup: {over} | '
+            f'memo SPF hit/miss: {memo["hits"]}/{memo["misses"]} | {dnscache.stats()}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    engine.add_arguments(parser)
+    store.add_arguments(parser)
+    dnscache.add_arguments(parser)
+    domainlist.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    dnscache.configure(args)
+
+    if args.shard:
+        global OUTPUT
+        OUTPUT = domainlist.shard_path(OUTPUT, args.shard)
+    domains = load_domains(args.domains or METADATI, args.keep_www, args.shard)
+    done = load_done(args.format)
     print(f'Gia\' scansionati: {len(done)}')
-    print(f'Da fare: {total}')
-    print(f'Batch: {BATCH} | Workers: {WORKERS} | Sleep: {SLEEP}s | Timeout: {TIMEOUT}s')
+    todo = schedule.plan(SCANNER, domains, done, OUTPUT, args)   # generatore, letto man mano
+
+    print(f'Batch: {BATCH} | Workers: {WORKERS} (iniziali) | Timeout: {TIMEOUT}s')
     print()
 
-    if not os.path.exists(OUTPUT) or os.path.getsize(OUTPUT) == 0:
-        with open(OUTPUT, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
-
-    scanned = 0
-
-    for i in range(0, total, BATCH):
-        batch = todo[i:i + BATCH]
-        results = []
-
-        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-            futures = {executor.submit(scan_domain, d): d for d in batch}
-            for future in as_completed(futures):
-                domain = futures[future]
-                try:
-                    r = future.result()
-                    results.append(r)
-                except Exception as e:
-                    r = {f: '' for f in FIELDNAMES}
-                    r['domain'] = domain
-                    r['error'] = str(e)[:200]
-                    results.append(r)
-                scanned += 1
-
-        with open(OUTPUT, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            for r in results:
-                writer.writerow(r)
-
-        caa = sum(1 for r in results if r.get('has_caa') == True)
-        wc = sum(1 for r in results if r.get('has_wildcard_dns') == True)
-        print(f'  [{scanned}/{total}] batch {i // BATCH + 1} | CAA: {caa} | wildcard: {wc}')
-
-        if i + BATCH < total:
-            time.sleep(SLEEP)
-
-    print(f'\nCompleto. {scanned} domini -> {OUTPUT}')
+    engine.run(todo, scan_domain, OUTPUT, FIELDNAMES,
+               workers=WORKERS, batch=BATCH, summary=summarize,
+               fmt=args.format, fsync_every=args.fsync_every,
+               adaptive=not args.fixed_workers,
+               targets=targets, target_rate=args.target_rate,
+               scanner=SCANNER, ttl=dnscache.remaining)
 
 
 if __name__ == '__main__':
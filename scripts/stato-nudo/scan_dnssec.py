@@ -2,80 +2,88 @@
 """
 Verifica DNSSEC per domini PA italiani.
 Salvataggio incrementale.
+Senza opzioni basta la presenza di DNSKEY o DS. Con --validate la catena
+viene verificata davvero (dnssec_chain): DS chiesto alla zona padre, digest
+contro le DNSKEY, firme e loro scadenza, algoritmi; has_dnssec e' vero solo
+per le deleghe valide.
 """
 
-import csv
-import dns.resolver
-import dns.rdatatype
+import argparse
 import os
 import sys
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import dnscache
+import dnssec_chain
+import domainlist
+import engine
+import schedule
+import store
 
 # --- Configurazione ---
 METADATI = os.path.join(os.path.dirname(__file__), 'output', 'pa_metadati.csv')
 OUTPUT   = os.path.join(os.path.dirname(__file__), 'output', 'dnssec_results.csv')
 BATCH    = 50
-SLEEP    = 0.5
 TIMEOUT  = 5
 WORKERS  = 15
+VALIDATE = False     # --validate
 # ----------------------
 
-FIELDNAMES = ['domain', 'has_dnssec', 'has_dnskey', 'has_ds', 'ns_records', 'error']
+SCANNER = 'dnssec'
+
+FIELDNAMES = [
+    'domain', 'has_dnssec', 'has_dnskey', 'has_ds', 'ns_records',
+    'dnssec_status', 'dnssec_reason', 'parent_zone', 'chain_secure', 'ds_match',
+    'rrsig_valid', 'rrsig_days_left', 'algorithms', 'ds_digest_types', 'weak_algorithm',
+    'error'
+]
 
 
-def load_domains():
-    domains = []
-    with open(METADATI, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        seen = set()
-        for row in reader:
-            d = row.get('domain', '').strip()
-            if d and '.' in d and not d.startswith('.') and d not in seen:
-                seen.add(d)
-                domains.append(d)
-    return sorted(domains)
+def load_domains(source=METADATI, keep_www=False, shard=None):
+    """Domini normalizzati e unici di `source` (vedi domainlist), uno alla volta in ordine di lettura."""
+    return domainlist.iter_domains(source, keep_www, shard)
 
 
-def load_done():
-    done = set()
-    if os.path.exists(OUTPUT):
-        with open(OUTPUT, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                done.add(row['domain'])
-    return done
+def load_done(fmt='csv'):
+    return store.load_done(OUTPUT, fmt)
 
 
 def dns_query(qname, rdtype):
-    try:
-        resolver = dns.resolver.Resolver()
-        resolver.timeout = TIMEOUT
-        resolver.lifetime = TIMEOUT
-        answers = resolver.resolve(qname, rdtype)
-        return [str(r) for r in answers]
-    except Exception:
-        return []
+    return dnscache.shared(TIMEOUT).query(qname, rdtype)
 
 
-def scan_domain(domain):
+def scan_domain(domain, query=dns_query):
     result = {f: '' for f in FIELDNAMES}
     result['domain'] = domain
 
     try:
-        # DNSKEY
-        dnskey = dns_query(domain, 'DNSKEY')
-        result['has_dnskey'] = bool(dnskey)
-
-        # DS (delegation signer) — va cercato nel parent
-        ds = dns_query(domain, 'DS')
-        result['has_ds'] = bool(ds)
-
-        # DNSSEC = ha almeno DNSKEY o DS
-        result['has_dnssec'] = bool(dnskey or ds)
+        if VALIDATE:
+            # DS dal padre e DNSKEY con le firme, al posto delle due query semplici
+            check = dnssec_chain.validate(domain)
+            result['has_dnskey'] = bool(check.get('algorithms'))
+            result['has_ds'] = bool(check.get('ds_digest_types'))
+            result['has_dnssec'] = check['status'] == 'secure'
+            result['dnssec_status'] = check['status']
+            result['dnssec_reason'] = check.get('reason', '')
+            if check['status'] == 'indeterminate':
+                # errore di rete, non assenza di DNSSEC: va riprovato
+                result['error'] = result['dnssec_reason']
+            for k in ('parent_zone', 'chain_secure', 'ds_match', 'rrsig_valid',
+                      'rrsig_days_left', 'algorithms', 'ds_digest_types', 'weak_algorithm'):
+                result[k] = check.get(k, '')
+        else:
+            # DNSKEY
+            dnskey = query(domain, 'DNSKEY')
+            result['has_dnskey'] = bool(dnskey)
+
+            # DS (delegation signer), dal resolver
+            ds = query(domain, 'DS')
+            result['has_ds'] = bool(ds)
+
+            # DNSSEC = ha almeno DNSKEY o DS
+            result['has_dnssec'] = bool(dnskey or ds)
 
         # NS
-        ns = dns_query(domain, 'NS')
+        ns = query(domain, 'NS')
         result['ns_records'] = ' | '.join(sorted(ns)[:5]) if ns else ''
 
     except Exception as e:
@@ -84,55 +92,53 @@ def scan_domain(domain):
     return result
 
 
-def main():
-    domains = load_domains()
-    done = load_done()
-    todo = [d for d in domains if d not in done]
+def targets(domain):
+    """Infrastruttura condivisa su cui limitare il ritmo: nameserver autoritativi."""
+    return dnscache.ns_targets(domain, TIMEOUT)
 
-    total = len(todo)
-    print(f'Totale domini: {len(domains)}')
+
+def summarize(results):
+    dnssec_count = sum(1 for r in results if r.get('has_dnssec') == True)
+    summary = f'DNSSEC: {dnssec_count}/{len(results)} | {dnscache.stats()}'
+    if VALIDATE:
+        bogus = sum(1 for r in results if r.get('dnssec_status') == 'bogus')
+        summary += f' | bogus: {bogus} | {dnssec_chain.stats()}'
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    engine.add_arguments(parser)
+    store.add_arguments(parser)
+    dnscache.add_arguments(parser)
+    domainlist.add_arguments(parser)
+    schedule.add_arguments(parser)
+    parser.add_argument('--validate', action='store_true',
+                        help='valida la catena DNSSEC (DS nel padre, digest, firme, algoritmi)')
+    args = parser.parse_args()
+    dnscache.configure(args)
+
+    global VALIDATE
+    VALIDATE = VALIDATE or args.validate
+
+    if args.shard:
+        global OUTPUT
+        OUTPUT = domainlist.shard_path(OUTPUT, args.shard)
+    domains = load_domains(args.domains or METADATI, args.keep_www, args.shard)
+    done = load_done(args.format)
     print(f'Gia\' scansionati: {len(done)}')
-    print(f'Da fare: {total}')
-    print(f'Batch: {BATCH} | Workers: {WORKERS} | Sleep: {SLEEP}s | Timeout: {TIMEOUT}s')
+    todo = schedule.plan(SCANNER, domains, done, OUTPUT, args)   # generatore, letto man mano
+
+    print(f'Batch: {BATCH} | Workers: {WORKERS} (iniziali) | Timeout: {TIMEOUT}s')
     print()
 
-    if not os.path.exists(OUTPUT) or os.path.getsize(OUTPUT) == 0:
-        with open(OUTPUT, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
-
-    scanned = 0
-
-    for i in range(0, total, BATCH):
-        batch = todo[i:i + BATCH]
-        results = []
-
-        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-            futures = {executor.submit(scan_domain, d): d for d in batch}
-            for future in as_completed(futures):
-                domain = futures[future]
-                try:
-                    r = future.result()
-                    results.append(r)
-                except Exception as e:
-                    r = {f: '' for f in FIELDNAMES}
-                    r['domain'] = domain
-                    r['error'] = str(e)[:200]
-                    results.append(r)
-                scanned += 1
-
-        with open(OUTPUT, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            for r in results:
-                writer.writerow(r)
-
-        dnssec_count = sum(1 for r in results if r.get('has_dnssec') == True)
-        print(f'  [{scanned}/{total}] batch {i // BATCH + 1} | DNSSEC: {dnssec_count}/{len(results)}')
-
-        if i + BATCH < total:
-            time.sleep(SLEEP)
-
-    print(f'\nCompleto. {scanned} domini -> {OUTPUT}')
+    engine.run(todo, scan_domain, OUTPUT, FIELDNAMES,
+               workers=WORKERS, batch=BATCH, summary=summarize,
+               fmt=args.format, fsync_every=args.fsync_every,
+               adaptive=not args.fixed_workers,
+               targets=targets, target_rate=args.target_rate,
+               scanner=SCANNER, ttl=dnscache.remaining)
 
 
 if __name__ == '__main__':
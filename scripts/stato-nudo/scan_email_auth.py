@@ -4,65 +4,77 @@ Scansione email authentication (SPF, DMARC, DKIM) per domini PA italiani.
 Salvataggio incrementale — se si blocca, riparte da dove era rimasto.
 """
 
-import csv
-import dns.resolver
+import argparse
 import os
 import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import dnscache
+import domainlist
+import engine
+import schedule
+import store
 
 # --- Configurazione ---
 METADATI = os.path.join(os.path.dirname(__file__), 'output', 'pa_metadati.csv')
 OUTPUT   = os.path.join(os.path.dirname(__file__), 'output', 'email_auth_results.csv')
-BATCH    = 50        # domini per batch
-SLEEP    = 0.5       # secondi tra batch
+BATCH    = 50        # domini per riga di progresso
 TIMEOUT  = 5         # secondi per query DNS
 WORKERS  = 15        # thread paralleli (DNS e' leggero)
+DKIM_WORKERS  = 64   # query DKIM in volo per tutto il processo
+DKIM_PARALLEL = 12   # selettori in volo per singolo dominio
+SELECTORS_FILE = os.path.join(os.path.dirname(__file__), 'dkim_selectors.txt')
 # ----------------------
 
+SCANNER = 'email_auth'
+
 FIELDNAMES = [
     'domain', 'has_mx', 'mx_records', 'spf_record', 'spf_class',
-    'dmarc_record', 'dmarc_class', 'dkim_found', 'dkim_selector', 'spoofable'
+    'dmarc_record', 'dmarc_class', 'dkim_found', 'dkim_selector', 'spoofable',
+    'dkim_probe_ms'
 ]
 
 DKIM_SELECTORS = ['default', 'selector1', 'selector2', 'google', 'k1', 'mail', 'dkim', 's1', 's2']
 
+# Pool condiviso: i selettori di domini diversi si alternano invece di accodarsi
+dkim_pool = ThreadPoolExecutor(max_workers=DKIM_WORKERS)
+
+
+def load_selectors():
+    """DKIM_SELECTORS seguiti dai selettori di SELECTORS_FILE, senza duplicati."""
+    selectors = list(DKIM_SELECTORS)
+    if os.path.exists(SELECTORS_FILE):
+        with open(SELECTORS_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                sel = line.strip().lower()
+                if sel and not sel.startswith('#'):
+                    selectors.append(sel)
+    return list(dict.fromkeys(selectors))
+
+
+SELECTORS = load_selectors()
 
-def load_domains():
-    """Carica domini unici dal CSV metadati, esclude quelli invalidi."""
-    domains = []
-    with open(METADATI, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        seen = set()
-        for row in reader:
-            d = row.get('domain', '').strip()
-            if d and '.' in d and not d.startswith('.') and d not in seen:
-                seen.add(d)
-                domains.append(d)
-    return sorted(domains)
 
+def load_domains(source=METADATI, keep_www=False, shard=None):
+    """Domini normalizzati e unici di `source` (vedi domainlist), uno alla volta in ordine di lettura."""
+    return domainlist.iter_domains(source, keep_www, shard)
 
-def load_done():
+
+def load_done(fmt='csv'):
     """Carica i domini gia' scansionati dal file output."""
-    done = set()
-    if os.path.exists(OUTPUT):
-        with open(OUTPUT, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                done.add(row['domain'])
-    return done
+    return store.load_done(OUTPUT, fmt)
 
 
 def dns_query(qname, rdtype):
     """Query DNS con timeout, ritorna lista stringhe o lista vuota."""
-    try:
-        resolver = dns.resolver.Resolver()
-        resolver.timeout = TIMEOUT
-        resolver.lifetime = TIMEOUT
-        answers = resolver.resolve(qname, rdtype)
-        return [str(r) for r in answers]
-    except Exception:
-        return []
+    return dnscache.shared(TIMEOUT).query(qname, rdtype)
+
+
+def dns_exists(qname):
+    """False solo per NXDOMAIN (vedi dnscache.CachingResolver.exists)."""
+    return dnscache.shared(TIMEOUT).exists(qname)
 
 
 def classify_spf(spf):
@@ -127,18 +139,66 @@ def assess_spoofability(spf_class, dmarc_class, dkim_found):
     return 'basso'
 
 
-def scan_domain(domain):
+def probe_dkim(domain, query=dns_query, exists=dns_exists):
+    """
+    Prova i selettori DKIM in parallelo (DKIM_PARALLEL alla volta sul pool condiviso).
+    Si ferma al primo selettore che risponde e cancella quelli non ancora partiti.
+    Prima una query su _domainkey.<domain>: se e' NXDOMAIN non esiste nessun
+    selettore (RFC 8020) e la ricerca si salta, invece di centinaia di query.
+    Ritorna (selettore o '', millisecondi).
+    """
+    start = time.monotonic()
+    if not exists(f'_domainkey.{domain}'):
+        return '', int((time.monotonic() - start) * 1000)
+    found = threading.Event()
+
+    def probe(sel):
+        if found.is_set():
+            return ''
+        dkim_qname = f'{sel}._domainkey.{domain}'
+        # Prova anche CNAME (Office 365 usa CNAME per DKIM)
+        if query(dkim_qname, 'TXT') or query(dkim_qname, 'CNAME'):
+            found.set()
+            return sel
+        return ''
+
+    selectors = iter(SELECTORS)
+    pending = set()
+    selector = ''
+    try:
+        while True:
+            while not found.is_set() and len(pending) < DKIM_PARALLEL:
+                sel = next(selectors, None)
+                if sel is None:
+                    break
+                pending.add(dkim_pool.submit(probe, sel))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            hits = [f.result() for f in done if f.result()]
+            if hits:
+                selector = hits[0]
+                break
+    finally:
+        found.set()
+        for f in pending:
+            f.cancel()
+
+    return selector, int((time.monotonic() - start) * 1000)
+
+
+def scan_domain(domain, query=dns_query):
     """Scansiona email auth per un singolo dominio."""
     result = {f: '' for f in FIELDNAMES}
     result['domain'] = domain
 
     # MX
-    mx = dns_query(domain, 'MX')
+    mx = query(domain, 'MX')
     result['has_mx'] = bool(mx)
     result['mx_records'] = ' | '.join(mx) if mx else ''
 
     # SPF
-    txts = dns_query(domain, 'TXT')
+    txts = query(domain, 'TXT')
     spf = ''
     for t in txts:
         t_clean = t.strip('"')
@@ -149,7 +209,7 @@ def scan_domain(domain):
     result['spf_class'] = classify_spf(spf)
 
     # DMARC
-    dmarc_txts = dns_query(f'_dmarc.{domain}', 'TXT')
+    dmarc_txts = query(f'_dmarc.{domain}', 'TXT')
     dmarc = ''
     for t in dmarc_txts:
         t_clean = t.strip('"')
@@ -159,25 +219,12 @@ def scan_domain(domain):
     result['dmarc_record'] = dmarc
     result['dmarc_class'] = classify_dmarc(dmarc)
 
-    # DKIM (prova selettori comuni)
-    dkim_found = False
-    dkim_selector = ''
-    for sel in DKIM_SELECTORS:
-        dkim_qname = f'{sel}._domainkey.{domain}'
-        answers = dns_query(dkim_qname, 'TXT')
-        if answers:
-            dkim_found = True
-            dkim_selector = sel
-            break
-        # Prova anche CNAME (Office 365 usa CNAME per DKIM)
-        cnames = dns_query(dkim_qname, 'CNAME')
-        if cnames:
-            dkim_found = True
-            dkim_selector = sel
-            break
-
+    # DKIM (prova selettori comuni, in parallelo)
+    dkim_selector, probe_ms = probe_dkim(domain, query)
+    dkim_found = bool(dkim_selector)
     result['dkim_found'] = dkim_found
     result['dkim_selector'] = dkim_selector
+    result['dkim_probe_ms'] = probe_ms
 
     # Spoofabilita'
     result['spoofable'] = assess_spoofability(
@@ -187,56 +234,49 @@ def scan_domain(domain):
     return result
 
 
-def main():
-    domains = load_domains()
-    done = load_done()
-    todo = [d for d in domains if d not in done]
+def targets(domain):
+    """Infrastruttura condivisa su cui limitare il ritmo: nameserver autoritativi."""
+    return dnscache.ns_targets(domain, TIMEOUT)
+
+
+def summarize(results):
+    spoofable_count = sum(1 for r in results if r.get('spoofable') in ('critico', 'alto'))
+    dkim = sum(1 for r in results if r.get('dkim_found') == True)
+    probe_ms = [r['dkim_probe_ms'] for r in results if r.get('dkim_probe_ms') != '']
+    avg_ms = sum(probe_ms) // len(probe_ms) if probe_ms else 0
+    return (f'spoofable: {spoofable_count}/{len(results)} | DKIM: {dkim} ({avg_ms}ms medi) | '
+            f'{dnscache.stats()}')
 
-    total = len(todo)
-    print(f'Totale domini: {len(domains)}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    engine.add_arguments(parser)
+    store.add_arguments(parser)
+    dnscache.add_arguments(parser)
+    domainlist.add_arguments(parser)
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    dnscache.configure(args)
+
+    if args.shard:
+        global OUTPUT
+        OUTPUT = domainlist.shard_path(OUTPUT, args.shard)
+    domains = load_domains(args.domains or METADATI, args.keep_www, args.shard)
+    done = load_done(args.format)
     print(f'Gia\' scansionati: {len(done)}')
-    print(f'Da fare: {total}')
-    print(f'Batch: {BATCH} | Workers: {WORKERS} | Sleep: {SLEEP}s | Timeout: {TIMEOUT}s')
+    todo = schedule.plan(SCANNER, domains, done, OUTPUT, args)   # generatore, letto man mano
+
+    print(f'Batch: {BATCH} | Workers: {WORKERS} (iniziali) | Timeout: {TIMEOUT}s')
+    print(f'Selettori DKIM: {len(SELECTORS)} ({DKIM_PARALLEL} in parallelo per dominio)')
     print()
 
-    # Crea file con header se non esiste
-    if not os.path.exists(OUTPUT) or os.path.getsize(OUTPUT) == 0:
-        with open(OUTPUT, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
-
-    scanned = 0
-
-    for i in range(0, total, BATCH):
-        batch = todo[i:i + BATCH]
-        results = []
-
-        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-            futures = {executor.submit(scan_domain, d): d for d in batch}
-            for future in as_completed(futures):
-                domain = futures[future]
-                try:
-                    r = future.result()
-                    results.append(r)
-                except Exception as e:
-                    r = {f: '' for f in FIELDNAMES}
-                    r['domain'] = domain
-                    results.append(r)
-                scanned += 1
-
-        # Salvataggio incrementale dopo ogni batch
-        with open(OUTPUT, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            for r in results:
-                writer.writerow(r)
-
-        spoofable_count = sum(1 for r in results if r.get('spoofable') in ('critico', 'alto'))
-        print(f'  [{scanned}/{total}] batch {i // BATCH + 1} salvato | spoofable: {spoofable_count}/{len(results)}')
-
-        if i + BATCH < total:
-            time.sleep(SLEEP)
-
-    print(f'\nCompleto. {scanned} domini scansionati -> {OUTPUT}')
+    engine.run(todo, scan_domain, OUTPUT, FIELDNAMES,
+               workers=WORKERS, batch=BATCH, summary=summarize,
+               fmt=args.format, fsync_every=args.fsync_every,
+               adaptive=not args.fixed_workers,
+               targets=targets, target_rate=args.target_rate,
+               scanner=SCANNER, ttl=dnscache.remaining)
 
 
 if __name__ == '__main__':
@@ -2,170 +2,152 @@
 """
 Scansione HTTP security headers per domini PA italiani.
 Salvataggio incrementale — se si blocca, riparte da dove era rimasto.
+Le richieste di un dominio condividono le connessioni (webclient.Session):
+la HEAD HTTPS e la catena di redirect da http:// usano keep-alive e HTTP/2
+dove possibile, e ogni tappa dei redirect viene salvata. CSP, HSTS e cookie
+vengono analizzati e pesati in un punteggio 0-10 (secheaders).
 """
 
-import csv
+import argparse
 import os
-import ssl
-import sys
-import time
-import urllib.request
 import urllib.error
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
+
+import dnscache
+import domainlist
+import engine
+import probes
+import schedule
+import secheaders
+import store
+import webclient
 
 # --- Configurazione ---
 METADATI = os.path.join(os.path.dirname(__file__), 'output', 'pa_metadati.csv')
 OUTPUT   = os.path.join(os.path.dirname(__file__), 'output', 'headers_results.csv')
-BATCH    = 50        # domini per batch
-SLEEP    = 0.5       # secondi tra batch
+BATCH    = 50        # domini per riga di progresso
 TIMEOUT  = 6         # secondi per richiesta
-WORKERS  = 10        # thread paralleli per batch
+WORKERS  = 10        # domini in volo all'avvio (poi adattivi)
 # ----------------------
 
+SCANNER = 'headers'
+
 FIELDNAMES = [
     'domain', 'https_ok', 'http_redirects_to_https', 'status_code',
     'has_hsts', 'hsts_max_age', 'has_csp', 'has_xframe', 'has_xcto',
-    'has_referrer_policy', 'has_permissions_policy', 'server', 'powered_by', 'error'
+    'has_referrer_policy', 'has_permissions_policy', 'server', 'powered_by',
+    'http_version', 'https_redirects', 'http_redirects',
+    'hsts_include_subdomains', 'hsts_preload',
+    'csp_report_only', 'csp_unsafe_inline', 'csp_unsafe_eval', 'csp_wildcard',
+    'csp_frame_ancestors', 'csp_id', 'cookie_count', 'cookie_names', 'cookies_weak',
+    'headers_score', 'headers_risk', 'error'
 ]
 
-write_lock = threading.Lock()
-counter = {'done': 0}
-
 
-def load_domains():
-    """Carica domini unici dal CSV metadati, esclude quelli invalidi."""
-    domains = []
-    with open(METADATI, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        seen = set()
-        for row in reader:
-            d = row.get('domain', '').strip()
-            if d and '.' in d and not d.startswith('.') and d not in seen:
-                seen.add(d)
-                domains.append(d)
-    return sorted(domains)
+def load_domains(source=METADATI, keep_www=False, shard=None):
+    """Domini normalizzati e unici di `source` (vedi domainlist), uno alla volta in ordine di lettura."""
+    return domainlist.iter_domains(source, keep_www, shard)
 
 
-def load_done():
+def load_done(fmt='csv'):
     """Carica i domini gia' scansionati dal file output."""
-    done = set()
-    if os.path.exists(OUTPUT):
-        with open(OUTPUT, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                done.add(row['domain'])
-    return done
+    return store.load_done(OUTPUT, fmt)
 
 
-def scan_domain(domain):
-    """Scansiona un singolo dominio per security headers."""
+def scan_domain(domain, hs=None):
+    """
+    Scansiona un singolo dominio per security headers.
+    `hs` e' un probes.tls_handshake(keep=True) gia' eseguito (scan_all): la
+    HEAD HTTPS viaggia sulla sua connessione invece di aprirne un'altra.
+    """
     result = {f: '' for f in FIELDNAMES}
     result['domain'] = domain
+    session = webclient.Session(TIMEOUT)
+    ssock = hs.pop('sock', None) if hs else None
+    if ssock is not None:
+        session.adopt(ssock, domain)
 
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
-    # 1. Prova HTTPS
-    https_url = f'https://{domain}'
-    try:
-        req = urllib.request.Request(https_url, method='HEAD')
-        req.add_header('User-Agent', 'Mozilla/5.0 (security-research)')
-        resp = urllib.request.urlopen(req, timeout=TIMEOUT, context=ctx)
-        headers = resp.headers
-        result['https_ok'] = True
-        result['status_code'] = resp.status
-
-        # Security headers
-        hsts = headers.get('Strict-Transport-Security', '')
-        result['has_hsts'] = bool(hsts)
-        if 'max-age=' in hsts:
-            try:
-                result['hsts_max_age'] = hsts.split('max-age=')[1].split(';')[0].strip()
-            except Exception:
-                pass
-
-        result['has_csp'] = bool(headers.get('Content-Security-Policy', ''))
-        result['has_xframe'] = bool(headers.get('X-Frame-Options', ''))
-        result['has_xcto'] = bool(headers.get('X-Content-Type-Options', ''))
-        result['has_referrer_policy'] = bool(headers.get('Referrer-Policy', ''))
-        result['has_permissions_policy'] = bool(headers.get('Permissions-Policy', ''))
-        result['server'] = headers.get('Server', '')
-        result['powered_by'] = headers.get('X-Powered-By', '')
-
-    except Exception as e:
-        result['https_ok'] = False
-        result['error'] = str(e)[:200]
-
-    # 2. Prova HTTP -> redirect a HTTPS?
-    http_url = f'http://{domain}'
     try:
-        req = urllib.request.Request(http_url, method='HEAD')
-        req.add_header('User-Agent', 'Mozilla/5.0 (security-research)')
-        resp = urllib.request.urlopen(req, timeout=TIMEOUT)
-        final_url = resp.url
-        result['http_redirects_to_https'] = final_url.startswith('https://')
-        if not result['status_code']:
-            result['status_code'] = resp.status
-    except Exception:
-        result['http_redirects_to_https'] = False
+        # 1. Prova HTTPS
+        try:
+            status, reason, headers, _, version, hops = session.head(f'https://{domain}/')
+            result['https_redirects'] = webclient.format_hops(hops)
+            if status >= 400:
+                raise urllib.error.HTTPError(f'https://{domain}/', status, reason, headers, None)
+            result['https_ok'] = True
+            result['status_code'] = status
+            result['http_version'] = version
+
+            # Security headers (analisi e punteggio in secheaders)
+            result['has_hsts'] = bool(headers.get('Strict-Transport-Security', ''))
+            result['has_csp'] = bool(headers.get('Content-Security-Policy', ''))
+            result['has_xframe'] = bool(headers.get('X-Frame-Options', ''))
+            result['has_xcto'] = bool(headers.get('X-Content-Type-Options', ''))
+            result['has_referrer_policy'] = bool(headers.get('Referrer-Policy', ''))
+            result['has_permissions_policy'] = bool(headers.get('Permissions-Policy', ''))
+            result['server'] = headers.get('Server', '')
+            result['powered_by'] = headers.get('X-Powered-By', '')
+            result.update(secheaders.analyze(headers))
+
+        except Exception as e:
+            result['https_ok'] = False
+            result['error'] = str(e)[:200]
+
+        # 2. Prova HTTP -> redirect a HTTPS? (le tappe gia' fatte al punto 1 non si ripetono)
+        try:
+            status, _, _, final_url, _, hops = session.head(f'http://{domain}/')
+            result['http_redirects'] = webclient.format_hops(hops)
+            result['http_redirects_to_https'] = status < 400 and final_url.startswith('https://')
+            if not result['status_code'] and status < 400:
+                result['status_code'] = status
+        except Exception:
+            result['http_redirects_to_https'] = False
+    finally:
+        session.close()
 
     return result
 
 
-def main():
-    domains = load_domains()
-    done = load_done()
-    todo = [d for d in domains if d not in done]
+def targets(domain):
+    """Infrastruttura condivisa su cui limitare il ritmo: IP del dominio."""
+    return dnscache.ip_targets(domain, TIMEOUT)
 
-    total = len(todo)
-    print(f'Totale domini: {len(domains)}')
+
+def summarize(results):
+    ok = sum(1 for r in results if r.get('https_ok') == True)
+    fail = len(results) - ok
+    return f'OK: {ok} FAIL: {fail} | {probes.stats()} | {webclient.stats()} | {secheaders.stats()}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    engine.add_arguments(parser)
+    store.add_arguments(parser)
+    dnscache.add_arguments(parser)
+    domainlist.add_arguments(parser)
+    schedule.add_arguments(parser)
+    probes.add_arguments(parser)
+    args = parser.parse_args()
+    dnscache.configure(args)
+
+    if args.shard:
+        global OUTPUT
+        OUTPUT = domainlist.shard_path(OUTPUT, args.shard)
+    domains = load_domains(args.domains or METADATI, args.keep_www, args.shard)
+    done = load_done(args.format)
     print(f'Gia\' scansionati: {len(done)}')
-    print(f'Da fare: {total}')
-    print(f'Batch: {BATCH} | Workers: {WORKERS} | Sleep: {SLEEP}s | Timeout: {TIMEOUT}s')
+    todo = schedule.plan(SCANNER, domains, done, OUTPUT, args)   # generatore, letto man mano
+
+    print(f'Batch: {BATCH} | Workers: {WORKERS} (iniziali) | Timeout: {TIMEOUT}s')
     print()
 
-    # Crea file con header se non esiste
-    if not os.path.exists(OUTPUT) or os.path.getsize(OUTPUT) == 0:
-        with open(OUTPUT, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
-
-    scanned = 0
-
-    for i in range(0, total, BATCH):
-        batch = todo[i:i + BATCH]
-        results = []
-
-        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-            futures = {executor.submit(scan_domain, d): d for d in batch}
-            for future in as_completed(futures):
-                domain = futures[future]
-                try:
-                    r = future.result()
-                    results.append(r)
-                except Exception as e:
-                    r = {f: '' for f in FIELDNAMES}
-                    r['domain'] = domain
-                    r['error'] = str(e)[:200]
-                    results.append(r)
-                scanned += 1
-
-        # Salvataggio incrementale dopo ogni batch
-        with open(OUTPUT, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            for r in results:
-                writer.writerow(r)
-
-        ok = sum(1 for r in results if r.get('https_ok') == True)
-        fail = len(results) - ok
-        print(f'  [{scanned}/{total}] batch {i // BATCH + 1} salvato | OK: {ok} FAIL: {fail}')
-
-        if i + BATCH < total:
-            time.sleep(SLEEP)
-
-    print(f'\nCompleto. {scanned} domini scansionati -> {OUTPUT}')
+    probes.warm(verify=False, bench_first=args.bench)
+    engine.run(todo, scan_domain, OUTPUT, FIELDNAMES,
+               workers=WORKERS, batch=BATCH, summary=summarize,
+               fmt=args.format, fsync_every=args.fsync_every,
+               adaptive=not args.fixed_workers,
+               targets=targets, target_rate=args.target_rate,
+               scanner=SCANNER)
 
 
 if __name__ == '__main__':
@@ -2,167 +2,169 @@
 """
 Verifica TLS e certificati per domini PA italiani.
 - Versione TLS negoziata (1.2 vs 1.3)
-- Info certificato: issuer, scadenza, giorni rimasti
+- Info certificato: issuer, scadenza, giorni rimasti (anche se non valido)
+- Con --enum: TLS 1.0/1.1/1.2 ancora attivi e cifrari deboli accettati
 - Salvataggio incrementale
 """
 
-import csv
+import argparse
 import os
-import socket
-import ssl
 import sys
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+import certs
+import dnscache
+import domainlist
+import engine
+import probes
+import schedule
+import store
+
 # --- Configurazione ---
 METADATI = os.path.join(os.path.dirname(__file__), 'output', 'pa_metadati.csv')
 OUTPUT   = os.path.join(os.path.dirname(__file__), 'output', 'tls_results.csv')
 BATCH    = 50
-SLEEP    = 0.3
 TIMEOUT  = 5
 WORKERS  = 25
 # ----------------------
 
+SCANNER = 'tls'
+
 FIELDNAMES = [
     'domain', 'tls_version', 'supports_tls13',
     'cert_issuer_org', 'cert_issuer_cn', 'cert_subject_cn',
     'cert_not_after', 'cert_days_left', 'cert_san_count',
+    'cert_verify_error',
+    'tls12', 'tls11', 'tls10', 'weak_ciphers', 'enum_probes', 'enum_complete',
+    'enum_unsupported',
     'error'
 ]
 
 
-def load_domains():
-    domains = []
-    with open(METADATI, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        seen = set()
-        for row in reader:
-            d = row.get('domain', '').strip()
-            if d and '.' in d and not d.startswith('.') and d not in seen:
-                seen.add(d)
-                domains.append(d)
-    return sorted(domains)
+def load_domains(source=METADATI, keep_www=False, shard=None):
+    """Domini normalizzati e unici di `source` (vedi domainlist), uno alla volta in ordine di lettura."""
+    return domainlist.iter_domains(source, keep_www, shard)
 
 
-def load_done():
-    done = set()
-    if os.path.exists(OUTPUT):
-        with open(OUTPUT, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                done.add(row['domain'])
-    return done
+def load_done(fmt='csv'):
+    return store.load_done(OUTPUT, fmt)
 
 
-def scan_domain(domain):
+def scan_domain(domain, hs=None, enum_budget=0):
+    """
+    `hs` e' un probes.tls_handshake() gia' eseguito (scan_all), altrimenti lo esegue.
+    Con `enum_budget` > 0 enumera anche versioni e cifrari (al massimo
+    enum_budget handshake in piu').
+    """
     result = {f: '' for f in FIELDNAMES}
     result['domain'] = domain
 
-    # 1. Connessione con verifica (per leggere il cert)
-    try:
-        ctx = ssl.create_default_context()
-        with socket.create_connection((domain, 443), timeout=TIMEOUT) as sock:
-            with ctx.wrap_socket(sock, server_hostname=domain) as ssock:
-                result['tls_version'] = ssock.version()
-                result['supports_tls13'] = ssock.version() == 'TLSv1.3'
-
-                cert = ssock.getpeercert()
-                if cert:
-                    issuer = dict(x[0] for x in cert.get('issuer', []))
-                    result['cert_issuer_org'] = issuer.get('organizationName', '')[:80]
-                    result['cert_issuer_cn'] = issuer.get('commonName', '')[:80]
-
-                    subject = dict(x[0] for x in cert.get('subject', []))
-                    result['cert_subject_cn'] = subject.get('commonName', '')[:80]
-
-                    not_after = cert.get('notAfter', '')
-                    result['cert_not_after'] = not_after
-                    if not_after:
-                        try:
-                            expiry = datetime.strptime(not_after, '%b %d %H:%M:%S %Y %Z')
-                            result['cert_days_left'] = (expiry - datetime.utcnow()).days
-                        except Exception:
-                            pass
-
-                    # SAN count
-                    sans = cert.get('subjectAltName', [])
-                    result['cert_san_count'] = len(sans)
+    if hs is None:
+        hs = probes.tls_handshake(domain, TIMEOUT)
 
+    if hs['error']:
+        result['error'] = hs['error']
+        # handshake rifiutato: puo' essere proprio un host solo TLS 1.0/1.1
+        if enum_budget > 0 and hs['rejected']:
+            enumerate_into(result, domain, '', enum_budget)
         return result
-    except ssl.SSLCertVerificationError:
-        # Cert non valido — riprova senza verifica per avere almeno la versione TLS
-        pass
-    except Exception as e:
-        result['error'] = str(e)[:200]
-        return result
 
-    # 2. Fallback senza verifica (cert scaduto/self-signed/mismatch)
-    try:
-        ctx2 = ssl.create_default_context()
-        ctx2.check_hostname = False
-        ctx2.verify_mode = ssl.CERT_NONE
-        with socket.create_connection((domain, 443), timeout=TIMEOUT) as sock:
-            with ctx2.wrap_socket(sock, server_hostname=domain) as ssock:
-                result['tls_version'] = ssock.version()
-                result['supports_tls13'] = ssock.version() == 'TLSv1.3'
-                result['error'] = 'cert_invalid'
-    except Exception as e:
-        result['error'] = str(e)[:200]
+    result['tls_version'] = hs['version']
+    result['supports_tls13'] = hs['version'] == 'TLSv1.3'
+
+    if enum_budget > 0:
+        enumerate_into(result, domain, hs['version'], enum_budget)
+
+    if not hs['verified']:
+        # Cert non valido: i dettagli arrivano comunque dalla catena DER.
+        # Senza trust store non si sa: errore da riprovare, non cert_invalid
+        result['error'] = 'cert_invalid' if hs['verify_error'] != certs.NO_TRUST_STORE else certs.NO_TRUST_STORE
+        result['cert_verify_error'] = hs['verify_error']
+
+    cert = hs['cert']
+    if cert:
+        issuer = dict(x[0] for x in cert.get('issuer', []))
+        result['cert_issuer_org'] = issuer.get('organizationName', '')[:80]
+        result['cert_issuer_cn'] = issuer.get('commonName', '')[:80]
+
+        subject = dict(x[0] for x in cert.get('subject', []))
+        result['cert_subject_cn'] = subject.get('commonName', '')[:80]
+
+        not_after = cert.get('notAfter', '')
+        result['cert_not_after'] = not_after
+        if not_after:
+            try:
+                expiry = datetime.strptime(not_after, '%b %d %H:%M:%S %Y %Z')
+                result['cert_days_left'] = (expiry - datetime.utcnow()).days
+            except Exception:
+                pass
+
+        # SAN count
+        sans = cert.get('subjectAltName', [])
+        result['cert_san_count'] = len(sans)
 
     return result
 
 
-def main():
-    domains = load_domains()
-    done = load_done()
-    todo = [d for d in domains if d not in done]
+def enumerate_into(result, domain, negotiated, enum_budget):
+    """Colonne di --enum da probes.enumerate_tls()."""
+    enum = probes.enumerate_tls(domain, TIMEOUT, negotiated, budget=enum_budget)
+    for col in ('tls12', 'tls11', 'tls10'):
+        result[col] = enum[col]
+    result['weak_ciphers'] = ' | '.join(enum['weak_ciphers'])
+    result['enum_probes'] = enum['probes']
+    result['enum_complete'] = enum['complete']
+    result['enum_unsupported'] = ' | '.join(enum['unsupported'])
+
+
+def targets(domain):
+    """Infrastruttura condivisa su cui limitare il ritmo: IP del dominio."""
+    return dnscache.ip_targets(domain, TIMEOUT)
+
 
-    total = len(todo)
-    print(f'Totale domini: {len(domains)}')
+def summarize(results):
+    tls13 = sum(1 for r in results if r.get('supports_tls13') == True)
+    invalid = sum(1 for r in results if r.get('error') == 'cert_invalid')
+    legacy = sum(1 for r in results if r.get('tls10') == True or r.get('tls11') == True)
+    return f'TLS1.3: {tls13} | TLS1.0/1.1: {legacy} | cert_invalid: {invalid}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    engine.add_arguments(parser)
+    store.add_arguments(parser)
+    dnscache.add_arguments(parser)
+    domainlist.add_arguments(parser)
+    schedule.add_arguments(parser)
+    probes.add_arguments(parser)
+    parser.add_argument('--enum', action='store_true',
+                        help='enumera versioni TLS e cifrari deboli per ogni host')
+    parser.add_argument('--enum-budget', type=int, default=probes.enum_budget(),
+                        help=f'handshake massimi per host con --enum (default: {probes.enum_budget()}, '
+                             'tutte le versioni e le famiglie)')
+    args = parser.parse_args()
+    dnscache.configure(args)
+
+    if args.shard:
+        global OUTPUT
+        OUTPUT = domainlist.shard_path(OUTPUT, args.shard)
+    domains = load_domains(args.domains or METADATI, args.keep_www, args.shard)
+    done = load_done(args.format)
     print(f'Gia\' scansionati: {len(done)}')
-    print(f'Da fare: {total}')
-    print(f'Batch: {BATCH} | Workers: {WORKERS} | Sleep: {SLEEP}s | Timeout: {TIMEOUT}s')
+    todo = schedule.plan(SCANNER, domains, done, OUTPUT, args)   # generatore, letto man mano
+
+    print(f'Batch: {BATCH} | Workers: {WORKERS} (iniziali) | Timeout: {TIMEOUT}s')
     print()
 
-    if not os.path.exists(OUTPUT) or os.path.getsize(OUTPUT) == 0:
-        with open(OUTPUT, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
-
-    scanned = 0
-
-    for i in range(0, total, BATCH):
-        batch = todo[i:i + BATCH]
-        results = []
-
-        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-            futures = {executor.submit(scan_domain, d): d for d in batch}
-            for future in as_completed(futures):
-                domain = futures[future]
-                try:
-                    r = future.result()
-                    results.append(r)
-                except Exception as e:
-                    r = {f: '' for f in FIELDNAMES}
-                    r['domain'] = domain
-                    r['error'] = str(e)[:200]
-                    results.append(r)
-                scanned += 1
-
-        with open(OUTPUT, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            for r in results:
-                writer.writerow(r)
-
-        tls13 = sum(1 for r in results if r.get('supports_tls13') == True)
-        invalid = sum(1 for r in results if r.get('error') == 'cert_invalid')
-        print(f'  [{scanned}/{total}] batch {i // BATCH + 1} | TLS1.3: {tls13} | cert_invalid: {invalid}')
-
-        if i + BATCH < total:
-            time.sleep(SLEEP)
-
-    print(f'\nCompleto. {scanned} domini -> {OUTPUT}')
+    probes.warm(enum=args.enum, bench_first=args.bench)
+    enum_budget = args.enum_budget if args.enum else 0
+    engine.run(todo, lambda d: scan_domain(d, enum_budget=enum_budget), OUTPUT, FIELDNAMES,
+               workers=WORKERS, batch=BATCH, summary=summarize,
+               fmt=args.format, fsync_every=args.fsync_every,
+               adaptive=not args.fixed_workers,
+               targets=targets, target_rate=args.target_rate,
+               scanner=SCANNER)
 
 
 if __name__ == '__main__':
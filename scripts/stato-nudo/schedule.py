@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Stato delle scansioni per (dominio, scanner) e scelta di cosa riscansionare.
+Ogni riga scritta aggiorna output/scan_state.sqlite con l'ora della scansione,
+un'impronta del risultato e la prossima scadenza:
+- errore (non un esito stabile come cert_invalid): si riprova dopo ERROR_RETRY
+- risultato invariato: l'intervallo raddoppia da BASE_AGE fino a MAX_AGE;
+  risultato cambiato: torna a BASE_AGE
+- scanner DNS: prima dell'intervallo, se scadono prima i TTL delle
+  risposte usate (ma non prima di TTL_MIN_AGE)
+- certificato in scadenza: da EXPIRY_MARGIN giorni prima si ricontrolla
+  ogni giorno, per vedere il rinnovo
+Con --rescan gli scanner aggiungono ai domini mai visti quelli scaduti,
+prima gli errori, poi i piu' in ritardo. Nel CSV le righe rifatte si
+aggiungono in coda (vale l'ultima; per parquet vedi store compact).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import store
+
+# --- Configurazione ---
+STATE_DB      = os.path.join(os.path.dirname(__file__), 'output', 'scan_state.sqlite')
+DAY           = 86400
+BASE_AGE      = 7 * DAY     # primo intervallo, e dopo ogni cambiamento
+MAX_AGE       = 56 * DAY    # nessun dominio resta piu' vecchio di cosi'
+ERROR_RETRY   = 1 * DAY
+TTL_MIN_AGE   = 1 * DAY     # un TTL scaduto anticipa la scansione, ma non sotto questa eta'
+EXPIRY_MARGIN = 14          # giorni prima della scadenza del certificato
+# ----------------------
+
+# Esiti che non cambiano riprovando: non sono errori da rifare subito
+STABLE_ERRORS = {'cert_invalid'}
+# Colonne che cambiano a ogni scansione senza che cambi nulla
+VOLATILE = {'cert_days_left', 'dkim_probe_ms', 'enum_probes', 'enum_complete', 'enum_unsupported',
+            'rrsig_days_left'}
+
+
+def add_arguments(parser):
+    parser.add_argument('--rescan', action='store_true',
+                        help='riscansiona anche i domini scaduti (errori, cert in scadenza, TTL/eta\')')
+    parser.add_argument('--rescan-limit', type=int, default=0, metavar='N',
+                        help='al massimo N domini da riscansionare (default: tutti quelli scaduti)')
+
+
+def digest(row):
+    """Impronta del risultato, senza le colonne volatili."""
+    stable = {k: v for k, v in row.items() if k not in VOLATILE and not k.startswith('_')}
+    return hashlib.sha1(json.dumps(stable, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _is_error(row):
+    return bool(row.get('error')) and row['error'] not in STABLE_ERRORS
+
+
+class State:
+    """Tabella state(domain, scanner, ...) su SQLite; commit a ogni sync del Writer."""
+
+    def __init__(self, path=STATE_DB):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS state ('
+            ' domain TEXT, scanner TEXT, last_scan REAL, interval REAL,'
+            ' digest TEXT, next_scan REAL, reason TEXT,'
+            ' PRIMARY KEY (domain, scanner))'
+        )
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def record(self, scanner, row, ttl=0):
+        """Aggiorna lo stato di row['domain'] dopo una scansione; `ttl` in secondi."""
+        now = time.time()
+        with self._lock:
+            prev = self.conn.execute(
+                'SELECT interval, digest FROM state WHERE domain = ? AND scanner = ?',
+                (row['domain'], scanner),
+            ).fetchone()
+            interval = BASE_AGE
+            if _is_error(row):
+                fp = prev[1] if prev else ''
+                interval = prev[0] if prev else BASE_AGE
+                next_scan, reason = now + ERROR_RETRY, 'errore'
+            else:
+                fp = digest(row)
+                if prev and prev[1] == fp:
+                    interval = min(prev[0] * 2, MAX_AGE)
+                next_scan, reason = now + interval, 'eta'
+                # TTL scaduto: le risposte usate possono essere cambiate
+                if ttl > 0 and max(ttl, TTL_MIN_AGE) < interval:
+                    next_scan, reason = now + max(ttl, TTL_MIN_AGE), 'ttl'
+
+                days_left = row.get('cert_days_left')
+                if isinstance(days_left, int):
+                    watch = now + (days_left - EXPIRY_MARGIN) * DAY
+                    if watch < next_scan:
+                        next_scan, reason = max(watch, now + DAY), 'scadenza_cert'
+
+            self.conn.execute(
+                'INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (row['domain'], scanner, now, interval, fp, next_scan, reason),
+            )
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def due(self, scanner, domains, output):
+        """
+        Domini di `domains` (gia' scansionati) da riscansionare adesso, in
+        ordine di priorita', e il conteggio per motivo. I domini senza stato
+        (prima dello scheduler) contano come scansionati alla data del file
+        di output.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT domain, next_scan, reason FROM state WHERE scanner = ?', (scanner,)
+            ).fetchall()
+        known = {d: (next_scan, reason) for d, next_scan, reason in rows}
+        unknown = (_mtime(output) + BASE_AGE, 'eta')
+
+        due = []
+        for d in domains:
+            next_scan, reason = known.get(d, unknown)
+            if next_scan <= now:
+                due.append((reason != 'errore', next_scan, d, reason))
+        due.sort()
+        return [d for _, _, d, _ in due], Counter(reason for *_, reason in due)
+
+
+def _mtime(output):
+    for path in (output, store.parquet_path(output)):
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+    return time.time()
+
+
+class Recorder:
+    """Avvolge un sink (vedi store): ogni riga scritta aggiorna anche lo stato."""
+
+    def __init__(self, sink, scanner, ttl=None):
+        self.sink = sink
+        self.scanner = scanner
+        self.ttl = ttl               # ttl(domain) -> secondi, per gli scanner DNS
+        self.state = shared()
+        self.path = sink.path
+
+    def write(self, row):
+        self.sink.write(row)
+        ttl = self.ttl(row['domain']) if self.ttl else 0
+        self.state.record(self.scanner, row, ttl)
+
+    def sync(self):
+        self.sink.sync()
+        self.state.commit()
+
+    def close(self):
+        self.sink.close()
+        self.state.commit()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = State()
+    return _shared
+
+
+def plan(scanner, domains, done, output, args):
+    """
+    Domini da scansionare, uno alla volta mentre `domains` viene letto: i mai
+    visti, poi con --rescan quelli scaduti (vedi rescan()). In memoria restano
+    solo i domini gia' fatti trovati nella sorgente, al massimo quanti `done`.
+    """
+    present = []
+    for d in domains:
+        if d not in done:
+            yield d
+        elif args.rescan:
+            present.append(d)
+    if args.rescan:
+        yield from rescan(scanner, present, output, args)
+
+
+def rescan(scanner, domains, output, args):
+    """Domini gia' fatti di `domains` scaduti (al massimo --rescan-limit). Stampa il riepilogo."""
+    due, reasons = shared().due(scanner, domains, output)
+    detail = ', '.join(f'{r}: {n}' for r, n in reasons.most_common())
+    print(f'Scaduti {scanner}: {len(due)} ({detail or "nessuno"})', flush=True)
+    if args.rescan_limit > 0:
+        due = due[:args.rescan_limit]
+    print(f'Da riscansionare {scanner}: {len(due)}', flush=True)
+    return due
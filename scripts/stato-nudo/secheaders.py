@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Analisi degli header di sicurezza HTTP e punteggio per dominio.
+- Content-Security-Policy: direttive, script inline/eval permessi, sorgenti
+  jolly ('*', 'https:', 'data:'...), frame-ancestors; piu' policy nello stesso
+  header o in piu' header valgono tutte insieme (vince la piu' restrittiva)
+- Strict-Transport-Security: max-age, includeSubDomains, preload (RFC 6797)
+- Set-Cookie: Secure, HttpOnly, SameSite per ogni cookie
+- X-Frame-Options, X-Content-Type-Options, Referrer-Policy
+I valori si ripetono molto tra domini (i CMS spediscono la stessa CSP): ogni
+valore distinto viene analizzato una volta sola e il risultato, immutabile,
+e' condiviso da tutti i domini che lo usano (lru_cache).
+"""
+
+import functools
+import hashlib
+from collections import namedtuple
+
+# --- Configurazione ---
+INTERN      = 20_000          # valori distinti tenuti in cache per tipo di header
+HSTS_STRONG = 180 * 86400     # max-age minimo per il punteggio pieno
+# ----------------------
+
+Csp = namedtuple('Csp', 'directives unsafe_inline unsafe_eval wildcard frame_ancestors id')
+Hsts = namedtuple('Hsts', 'max_age include_subdomains preload')
+CookieFlags = namedtuple('CookieFlags', 'secure httponly samesite')
+
+# Sorgenti che lasciano caricare script da (quasi) ovunque
+WILDCARD_SOURCES = {'*', 'http:', 'https:', 'data:', 'blob:'}
+# Referrer-Policy che mandano l'URL completo anche ad altri siti
+UNSAFE_REFERRER = {'unsafe-url', 'no-referrer-when-downgrade'}
+REFERRER_POLICIES = UNSAFE_REFERRER | {
+    'no-referrer', 'origin', 'origin-when-cross-origin', 'same-origin',
+    'strict-origin', 'strict-origin-when-cross-origin',
+}
+
+
+def _script_sources(directives):
+    for name in ('script-src', 'default-src'):
+        if name in directives:
+            return directives[name]
+    return None
+
+
+@functools.lru_cache(maxsize=INTERN)
+def _parse_policy(policy):
+    """Una singola policy CSP (senza virgole): {direttiva: tupla di sorgenti}."""
+    directives = {}
+    for part in policy.split(';'):
+        tokens = part.split()
+        if not tokens:
+            continue
+        name = tokens[0].lower()
+        if name not in directives:       # la prima occorrenza vince
+            directives[name] = tuple(t.lower() for t in tokens[1:])
+
+    scripts = _script_sources(directives)
+    if scripts is None:
+        unsafe_inline, unsafe_eval, wildcard = True, True, True
+    else:
+        # con nonce/hash (o strict-dynamic) i browser ignorano 'unsafe-inline'
+        # e, con strict-dynamic, anche le sorgenti per host o schema
+        strict = "'strict-dynamic'" in scripts
+        nonce = any(s.startswith(("'nonce-", "'sha256-", "'sha384-", "'sha512-")) for s in scripts)
+        unsafe_inline = "'unsafe-inline'" in scripts and not (nonce or strict)
+        unsafe_eval = "'unsafe-eval'" in scripts
+        wildcard = not strict and any(s in WILDCARD_SOURCES for s in scripts)
+
+    ancestors = directives.get('frame-ancestors')
+    frame_ancestors = ancestors is not None and '*' not in ancestors
+    canonical = ';'.join(f'{k} {" ".join(v)}' for k, v in sorted(directives.items()))
+    return Csp(tuple(directives.items()), unsafe_inline, unsafe_eval, wildcard, frame_ancestors,
+               hashlib.sha1(canonical.encode()).hexdigest()[:12])
+
+
+def parse_csp(values):
+    """
+    Tutte le policy degli header CSP (lista di valori): una risorsa e' bloccata
+    se la blocca almeno una policy. None se non c'e' nessuna policy.
+    """
+    policies = [_parse_policy(p.strip()) for v in values for p in v.split(',') if p.strip()]
+    if not policies:
+        return None
+    if len(policies) == 1:
+        return policies[0]
+    return Csp(
+        tuple(d for p in policies for d in p.directives),
+        all(p.unsafe_inline for p in policies),
+        all(p.unsafe_eval for p in policies),
+        all(p.wildcard for p in policies),
+        any(p.frame_ancestors for p in policies),
+        '+'.join(p.id for p in policies),
+    )
+
+
+@functools.lru_cache(maxsize=INTERN)
+def parse_hsts(value):
+    """Strict-Transport-Security; max_age None se assente o non valido."""
+    max_age, include, preload = None, False, False
+    for part in value.split(';'):
+        name, _, arg = part.strip().partition('=')
+        name = name.strip().lower()
+        if name == 'max-age':
+            try:
+                max_age = int(arg.strip().strip('"'))
+            except ValueError:
+                pass
+        elif name == 'includesubdomains':
+            include = True
+        elif name == 'preload':
+            preload = True
+    return Hsts(max_age, include, preload)
+
+
+@functools.lru_cache(maxsize=INTERN)
+def _cookie_flags(attributes):
+    """Attributi di un Set-Cookie (tutto dopo il primo ';'): identici tra molti domini."""
+    flags = {}
+    for a in attributes.split(';'):
+        name, _, arg = a.partition('=')
+        flags[name.strip().lower()] = arg.strip().lower()
+    return CookieFlags('secure' in flags, 'httponly' in flags, flags.get('samesite', ''))
+
+
+def parse_cookies(values):
+    """[(nome, CookieFlags), ...] dai valori di Set-Cookie."""
+    cookies = []
+    for v in values:
+        pair, _, attributes = v.partition(';')
+        name = pair.split('=', 1)[0].strip()
+        if name:
+            cookies.append((name, _cookie_flags(attributes)))
+    return cookies
+
+
+def referrer_policy(value):
+    """Ultimo token valido di Referrer-Policy (come i browser), '' se nessuno."""
+    policy = ''
+    for token in value.split(','):
+        token = token.strip().lower()
+        if token in REFERRER_POLICIES:
+            policy = token
+    return policy
+
+
+def risk(score):
+    if score >= 8:
+        return 'basso'
+    elif score >= 5:
+        return 'medio'
+    elif score >= 2:
+        return 'alto'
+    return 'critico'
+
+
+def analyze(headers):
+    """Colonne di analisi per scan_headers da una risposta HTTPS; `headers` e' un HTTPMessage."""
+    out = {}
+    score = 0
+
+    # HSTS (0-3): conta solo il primo header, come nei browser
+    hsts = parse_hsts(headers.get('Strict-Transport-Security', ''))
+    out['hsts_max_age'] = hsts.max_age if hsts.max_age is not None else ''
+    out['hsts_include_subdomains'] = hsts.include_subdomains
+    out['hsts_preload'] = hsts.preload
+    if hsts.max_age:
+        score += 2 if hsts.max_age >= HSTS_STRONG else 1
+        if hsts.include_subdomains:
+            score += 1
+
+    # CSP (0-3) e protezione dal framing (0-1)
+    csp = parse_csp(headers.get_all('Content-Security-Policy') or [])
+    report_only = parse_csp(headers.get_all('Content-Security-Policy-Report-Only') or [])
+    out['csp_report_only'] = csp is None and report_only is not None
+    out['csp_unsafe_inline'] = csp.unsafe_inline if csp else ''
+    out['csp_unsafe_eval'] = csp.unsafe_eval if csp else ''
+    out['csp_wildcard'] = csp.wildcard if csp else ''
+    out['csp_frame_ancestors'] = csp.frame_ancestors if csp else False
+    out['csp_id'] = csp.id if csp else ''
+    if csp:
+        score += 1
+        score += not csp.unsafe_inline
+        score += not csp.wildcard
+    xfo = headers.get('X-Frame-Options', '').strip().lower()
+    if xfo in ('deny', 'sameorigin') or out['csp_frame_ancestors']:
+        score += 1
+
+    # X-Content-Type-Options e Referrer-Policy (0-1 ciascuno)
+    if headers.get('X-Content-Type-Options', '').strip().lower() == 'nosniff':
+        score += 1
+    referrer = referrer_policy(headers.get('Referrer-Policy', ''))
+    if referrer and referrer not in UNSAFE_REFERRER:
+        score += 1
+
+    # Cookie (0-1): tutti con Secure, HttpOnly e SameSite (o nessun cookie)
+    cookies = parse_cookies(headers.get_all('Set-Cookie') or [])
+    weak = [name for name, f in cookies if not (f.secure and f.httponly and f.samesite)]
+    out['cookie_count'] = len(cookies)
+    out['cookie_names'] = ' | '.join(name for name, _ in cookies)
+    out['cookies_weak'] = ' | '.join(weak)
+    if not weak:
+        score += 1
+
+    out['headers_score'] = score
+    out['headers_risk'] = risk(score)
+    return out
+
+
+def stats():
+    csp = _parse_policy.cache_info()
+    return f'CSP distinte: {csp.currsize} (riusate {csp.hits} volte)'
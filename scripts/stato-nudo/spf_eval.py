@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Espansione ricorsiva dei record SPF (RFC 7208).
+Segue include, redirect, a, mx, conta le query DNS rispetto al limite di 10,
+rileva i loop e calcola lo spazio IPv4/IPv6 effettivamente autorizzato.
+L'espansione di ogni nome senza errori e' memorizzata per tutta l'esecuzione:
+i record PA includono quasi sempre gli stessi pochi provider.
+"""
+
+import ipaddress
+import re
+import threading
+
+# --- Configurazione ---
+LOOKUP_LIMIT = 10        # RFC 7208 4.6.4
+MX_LIMIT     = 10        # host MX valutati per singolo meccanismo mx
+MAX_DEPTH    = 10        # profondita' massima di include/redirect
+COUNT_MAX    = 2 ** 63 - 1   # i conteggi finiscono in colonne int64 (ip6:::/0 sono 2**64 /64)
+# ----------------------
+
+TERM_RE = re.compile(r'^([+\-~?]?)([a-z0-9]+)(?::([^/]*))?(?:/(\d+))?(?://(\d+))?$', re.I)
+LOOKUP_TERMS = {'include', 'a', 'mx', 'ptr', 'exists'}
+
+_memo = {}
+_memo_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0}
+
+
+def find_spf(txt_records):
+    """Il primo record v=spf1 tra le risposte TXT."""
+    for t in txt_records:
+        t = t.replace('" "', '').strip('"')
+        if t.lower().startswith('v=spf1'):
+            return t
+    return ''
+
+
+def _expansion(error=''):
+    return {'lookups': 0, 'ip4': [], 'ip6': [], 'error': error, 'loop': False}
+
+
+def _host_networks(host, prefix4, prefix6, query):
+    """Reti /prefix attorno agli indirizzi A/AAAA di host."""
+    nets4 = [ipaddress.ip_network(f'{ip}/{prefix4}', strict=False) for ip in query(host, 'A')]
+    nets6 = [ipaddress.ip_network(f'{ip}/{prefix6}', strict=False) for ip in query(host, 'AAAA')]
+    return nets4, nets6
+
+
+def _evaluate(name, record, query, stack):
+    """Valuta un record SPF gia' letto. Solo i meccanismi '+' autorizzano indirizzi."""
+    result = _expansion()
+    redirect = ''
+    has_all = False
+
+    for term in record.split()[1:]:
+        lower = term.lower()
+        if lower.startswith('redirect='):
+            redirect = term.split('=', 1)[1]
+            continue
+        if '=' in lower.split(':', 1)[0]:
+            continue  # altri modificatori (exp=...)
+
+        qualifier = '+'
+        if term[0] in '+-~?':
+            qualifier, term = term[0], term[1:]
+        lower = term.lower()
+
+        if lower.startswith('ip4:') or lower.startswith('ip6:'):
+            if qualifier != '+':
+                continue
+            try:
+                net = ipaddress.ip_network(term[4:], strict=False)
+            except ValueError:
+                result['error'] = result['error'] or f'ip non valido: {term[:60]}'
+                continue
+            result['ip4' if net.version == 4 else 'ip6'].append(net)
+            continue
+
+        m = TERM_RE.match(term)
+        if not m:
+            result['error'] = result['error'] or f'termine non valido: {term[:60]}'
+            continue
+        _, mech, target, p4, p6 = m.groups()
+        mech = mech.lower()
+        target = (target or name).rstrip('.')
+
+        if mech == 'all':
+            has_all = True
+            continue
+        if mech not in LOOKUP_TERMS:
+            continue
+
+        result['lookups'] += 1
+        if '%' in target:
+            continue  # macro: non espandibile senza un IP mittente
+
+        if mech == 'include':
+            sub = expand(target, query, stack)
+            result['lookups'] += sub['lookups']
+            result['loop'] |= sub['loop']
+            if sub['error']:
+                result['error'] = result['error'] or sub['error']
+            if qualifier == '+':
+                result['ip4'] += sub['ip4']
+                result['ip6'] += sub['ip6']
+        elif mech in ('a', 'mx') and qualifier == '+':
+            prefix4 = int(p4) if p4 else 32
+            prefix6 = int(p6) if p6 else 128
+            hosts = [target]
+            if mech == 'mx':
+                hosts = [mx.split()[-1].rstrip('.') for mx in query(target, 'MX')][:MX_LIMIT]
+            for host in hosts:
+                try:
+                    nets4, nets6 = _host_networks(host, prefix4, prefix6, query)
+                except ValueError:
+                    continue
+                result['ip4'] += nets4
+                result['ip6'] += nets6
+
+    if redirect and not has_all:
+        result['lookups'] += 1
+        sub = expand(redirect, query, stack)
+        result['lookups'] += sub['lookups']
+        result['loop'] |= sub['loop']
+        result['ip4'] += sub['ip4']
+        result['ip6'] += sub['ip6']
+        if sub['error']:
+            result['error'] = result['error'] or sub['error']
+
+    result['ip4'] = list(ipaddress.collapse_addresses(result['ip4']))
+    result['ip6'] = list(ipaddress.collapse_addresses(result['ip6']))
+    return result
+
+
+def expand(name, query, stack=()):
+    """
+    Espansione del record SPF di `name`:
+      lookups - query DNS richieste dalla valutazione (include annidati compresi)
+      ip4/ip6 - reti autorizzate, gia' compattate
+      error   - primo problema incontrato ('' se nessuno)
+      loop    - True se la catena include/redirect torna su se stessa
+    """
+    name = name.lower().rstrip('.')
+    if name in stack:
+        result = _expansion(f'loop: {name}')
+        result['loop'] = True
+        return result
+    if len(stack) >= MAX_DEPTH:
+        return _expansion(f'troppo profondo: {name}')
+
+    with _memo_lock:
+        cached = _memo.get(name)
+        if cached is not None:
+            stats['hits'] += 1
+            return cached
+        stats['misses'] += 1
+
+    record = find_spf(query(name, 'TXT'))
+    if not record:
+        result = _expansion(f'nessun SPF: {name}')
+    else:
+        result = _evaluate(name, record, query, stack + (name,))
+
+    # Un risultato con loop dipende dal percorso: non va riusato altrove.
+    # Nemmeno uno con errore: query() da' [] anche per un timeout, e un
+    # 'nessun SPF' transitorio su un include condiviso (_spf.google.com)
+    # rovinerebbe tutti i domini successivi. Rifarlo costa poco: le risposte
+    # negative definitive (NXDOMAIN/NoAnswer) restano nella cache di dnscache.
+    if not result['loop'] and not result['error']:
+        with _memo_lock:
+            _memo[name] = result
+    return result
+
+
+def address_count(networks):
+    return min(COUNT_MAX, sum(net.num_addresses for net in networks))
+
+
+def subnet_count(networks, prefix):
+    """
+    Numero di sottoreti /prefix coperte (per IPv6 gli indirizzi non stanno in
+    un int64), saturato a COUNT_MAX: ip6:::/0 vale "tutto", non un overflow.
+    """
+    return min(COUNT_MAX, sum(2 ** max(0, prefix - net.prefixlen) for net in networks))
@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+Backend di salvataggio dei risultati degli scanner stato-nudo.
+Ogni risultato viene scritto appena il dominio e' finito (write()), sync()
+fa l'fsync: un crash o un Ctrl-C perdono solo i domini ancora in volo.
+- csv:     il formato storico, un file per scanner, piu' un checkpoint
+           <nome>.done con un dominio per riga letto da load_done()
+- parquet: colonne tipizzate (i booleani restano booleani, gli interi interi),
+           un file per row group dentro <nome>.parquet/ e un indice dei
+           domini (_domains.idx). Le righe non ancora in un row group stanno
+           nel write-ahead log _pending.jsonl e vengono recuperate alla
+           riapertura. Richiede pyarrow.
+La chiave di ogni riga e' 'domain', oppure la colonna passata come `key`
+(es. 'fingerprint' per la tabella dei certificati); e' sempre la prima colonna.
+
+Uso da riga di comando:
+  python store.py convert output/tls_results.csv ...   CSV -> parquet tipizzato
+  python store.py compact output/tls_results.csv ...   un solo file, senza duplicati
+  python store.py merge output/tls_results.csv ...     shard (--shard i/N) -> file canonico
+"""
+
+import csv
+import glob
+import json
+import os
+import re
+import sys
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = ['csv', 'parquet']
+INDEX = '_domains.idx'
+PENDING = '_pending.jsonl'
+REJECTED = '_rejected.jsonl'
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+ROW_GROUP = 500          # righe per file parquet
+
+
+def add_arguments(parser):
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='formato di output (default: csv)')
+
+
+def parquet_path(output):
+    """output/tls_results.csv -> output/tls_results.parquet (directory)."""
+    return os.path.splitext(output)[0] + '.parquet'
+
+
+def checkpoint_path(output):
+    """output/tls_results.csv -> output/tls_results.done"""
+    return os.path.splitext(output)[0] + '.done'
+
+
+def _repair_tail(path):
+    """Chiude con un a capo una riga troncata da un crash, cosi' le nuove non si fondono."""
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+
+
+def _complete_lines(path):
+    """Righe di un file append-only, scartando l'ultima se troncata."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = f.read()
+    lines = data.split('\n')
+    return [line for line in lines[:-1] if line.strip()]
+
+
+def _fsync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _csv_header(path):
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), [])
+
+
+def _migrate_csv(output, fieldnames):
+    """
+    Riscrive un CSV con un'intestazione diversa da `fieldnames` (scanner
+    aggiornato tra un'esecuzione e l'altra): le colonne di `fieldnames`, poi
+    quelle vecchie che non ci sono piu'; i valori restano sotto il loro nome.
+    Ritorna le colonne del file riscritto.
+    """
+    old = _csv_header(output)
+    columns = list(fieldnames) + [c for c in old if c not in fieldnames]
+    _repair_tail(output)
+    with open(output, 'r', newline='', encoding='utf-8') as src, \
+            open(output + '.tmp', 'w', newline='', encoding='utf-8') as dst:
+        writer = csv.DictWriter(dst, fieldnames=columns, restval='')
+        writer.writeheader()
+        for row in csv.DictReader(src):
+            row.pop(None, None)      # valori oltre l'intestazione: righe gia' storte
+            writer.writerow(row)
+        _fsync(dst)
+    os.replace(output + '.tmp', output)
+    added = [c for c in fieldnames if c not in old]
+    print(f'{output}: intestazione aggiornata ({len(added)} colonne nuove)', flush=True)
+    return columns
+
+
+class CsvStore:
+    """
+    Il CSV storico, tenuto aperto. Colonne mancanti vuote, colonne extra ignorate.
+    Un file esistente con colonne diverse da `fieldnames` viene prima
+    riscritto (vedi _migrate_csv): le righe nuove non finiscono mai sotto
+    l'intestazione sbagliata.
+    """
+
+    def __init__(self, output, fieldnames, key='domain'):
+        self.path = output
+        self.fieldnames = fieldnames
+        self.key = key
+        checkpoint_mode = 'a'
+        if not os.path.exists(output) or os.path.getsize(output) == 0:
+            with open(output, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+            checkpoint_mode = 'w'   # CSV nuovo: un vecchio checkpoint non vale piu'
+        elif _csv_header(output) != list(fieldnames):
+            fieldnames = _migrate_csv(output, fieldnames)
+        _repair_tail(output)
+        _repair_tail(checkpoint_path(output))
+        self.f = open(output, 'a', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.f, fieldnames=fieldnames, restval='', extrasaction='ignore')
+        self.done = open(checkpoint_path(output), checkpoint_mode, encoding='utf-8')
+
+    def write(self, row):
+        # prima la riga, poi il checkpoint: un crash in mezzo da' un duplicato, non un buco
+        self.writer.writerow(row)
+        self.f.flush()
+        self.done.write(row[self.key] + '\n')
+        self.done.flush()
+
+    def append(self, rows):
+        for r in rows:
+            self.write(r)
+
+    def sync(self):
+        _fsync(self.f)
+        _fsync(self.done)
+
+    def close(self):
+        self.sync()
+        self.f.close()
+        self.done.close()
+
+
+def _infer_type(values):
+    """Tipo arrow dal primo valore non vuoto; colonna tutta vuota -> null."""
+    for v in values:
+        if v == '' or v is None:
+            continue
+        if isinstance(v, bool):
+            return pa.bool_()
+        if isinstance(v, int):
+            return pa.int64() if INT64_MIN <= v <= INT64_MAX else pa.float64()
+        if isinstance(v, float):
+            return pa.float64()
+        return pa.string()
+    return pa.null()
+
+
+def _fit(v, typ):
+    """
+    (valore, ok): `v` portato al tipo gia' stabilito per la colonna, '' -> null.
+    ok False se non ci sta (intero oltre int64, testo in una colonna
+    numerica...): il valore e' None, e sta al chiamante dirlo.
+    """
+    if v == '' or v is None:
+        return None, True
+    try:
+        if pa.types.is_boolean(typ):
+            if isinstance(v, bool):
+                return v, True
+            if str(v) in ('True', 'False'):
+                return str(v) == 'True', True
+            return None, False
+        if pa.types.is_integer(typ):
+            if isinstance(v, float) and not v.is_integer():
+                return None, False
+            n = int(v)
+            return (n, True) if INT64_MIN <= n <= INT64_MAX else (None, False)
+        if pa.types.is_floating(typ):
+            return float(v), True
+    except (TypeError, ValueError, OverflowError):
+        return None, False
+    return str(v), True
+
+
+class ParquetStore:
+    """Dataset parquet append-only: un nuovo file ogni `row_group` righe."""
+
+    def __init__(self, output, fieldnames, row_group=ROW_GROUP, key='domain'):
+        if pa is None:
+            sys.exit('--format parquet richiede pyarrow (pip install pyarrow)')
+        self.path = parquet_path(output)
+        self.fieldnames = fieldnames
+        self.key = key
+        self.row_group = row_group
+        self.index = os.path.join(self.path, INDEX)
+        self.pending = os.path.join(self.path, PENDING)
+        os.makedirs(self.path, exist_ok=True)
+
+        parts = sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+        self.part = int(parts[-1][-14:-8]) + 1 if parts else 0
+        self.types = {}
+        if parts:
+            schema = pa.unify_schemas([pq.read_schema(p) for p in parts])
+            self.types = {f.name: f.type for f in schema if not pa.types.is_null(f.type)}
+
+        # Recupero: le righe rimaste nel WAL da un'esecuzione interrotta.
+        # Una riga che non si converte finisce in _rejected.jsonl invece di
+        # rendere il dataset impossibile da riaprire; il dominio si rifara'.
+        if os.path.exists(self.pending):
+            rows, rejected = [], []
+            for line in _complete_lines(self.pending):
+                try:
+                    rows.append(self._check(json.loads(line)))
+                except (ValueError, TypeError, AttributeError):
+                    rejected.append(line)
+            if rows:
+                try:
+                    self._write_part(rows)
+                except (pa.ArrowException, ValueError, TypeError, OverflowError, KeyError):
+                    rejected += [json.dumps(r, default=str) for r in rows]
+            if rejected:
+                self._quarantine(rejected)
+        self.buffer = []
+        self.wal = open(self.pending, 'w', encoding='utf-8')
+
+    def _check(self, row):
+        """
+        La riga pronta per il WAL: ogni valore deve stare nel tipo della sua
+        colonna (fissato qui dal primo valore non vuoto). Uno che non ci sta
+        diventa vuoto, con il motivo in 'error' e a video: mai in silenzio,
+        e nel WAL entrano solo righe che _write_part sa convertire.
+        """
+        row = dict(row)
+        bad = []
+        for name in self.fieldnames:
+            v = row.get(name, '')
+            if v == '' or v is None:
+                continue
+            typ = self.types.get(name)
+            if typ is None:
+                typ = self.types[name] = _infer_type([v])
+            if not _fit(v, typ)[1]:
+                bad.append(f'{name}={str(v)[:40]}')
+                row[name] = ''
+        if bad:
+            note = f'valori fuori tipo scartati: {", ".join(bad)}'
+            if 'error' in self.fieldnames:
+                row['error'] = f"{row['error']} | {note}" if row.get('error') else note
+            print(f'{self.path}: {row.get(self.key)}: {note}', flush=True)
+        return row
+
+    def _quarantine(self, lines):
+        path = os.path.join(self.path, REJECTED)
+        with open(path, 'a', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line + '\n')
+            _fsync(f)
+        print(f'{self.pending}: {len(lines)} righe non convertibili spostate in {path}', flush=True)
+
+    def _write_part(self, rows):
+        fields, arrays = [], []
+        for name in self.fieldnames:
+            values = [r.get(name, '') for r in rows]
+            typ = self.types.get(name) or _infer_type(values)
+            if not pa.types.is_null(typ):
+                self.types[name] = typ
+            arrays.append(pa.array([_fit(v, typ)[0] for v in values], type=typ))
+            fields.append(pa.field(name, typ))
+        table = pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+        # file completo o niente: scrittura su .tmp, fsync e rename atomico
+        final = os.path.join(self.path, f'part-{self.part:06d}.parquet')
+        pq.write_table(table, final + '.tmp')
+        with open(final + '.tmp', 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(final + '.tmp', final)
+        self.part += 1
+
+        with open(self.index, 'a', encoding='utf-8') as f:
+            for r in rows:
+                f.write(r[self.key] + '\n')
+            _fsync(f)
+
+    def write(self, row):
+        row = self._check(row)
+        self.wal.write(json.dumps(row, default=str) + '\n')
+        self.wal.flush()
+        self.buffer.append(row)
+        if len(self.buffer) >= self.row_group:
+            self._write_part(self.buffer)
+            self.buffer = []
+            self.wal.seek(0)
+            self.wal.truncate()
+
+    def append(self, rows):
+        """Scrive direttamente un row group (conversioni in blocco, senza WAL)."""
+        if rows:
+            self._write_part([self._check(r) for r in rows])
+
+    def sync(self):
+        _fsync(self.wal)
+
+    def close(self):
+        if self.buffer:
+            self._write_part(self.buffer)
+            self.buffer = []
+        self.wal.close()
+        os.remove(self.pending)
+
+
+def open_store(output, fieldnames, fmt='csv', key='domain'):
+    if fmt == 'parquet':
+        return ParquetStore(output, fieldnames, key=key)
+    return CsvStore(output, fieldnames, key=key)
+
+
+def load_done(output, fmt='csv', key='domain'):
+    """
+    Domini (o chiavi `key`) gia' scritti, dal checkpoint compatto invece che dai dati.
+    CSV senza checkpoint (esecuzioni precedenti): viene letto una volta e
+    il checkpoint creato da li'.
+    """
+    done = set()
+    if fmt == 'parquet':
+        path = parquet_path(output)
+        for name in (INDEX, PENDING):
+            if os.path.exists(os.path.join(path, name)):
+                lines = _complete_lines(os.path.join(path, name))
+                if name == PENDING:
+                    lines = [json.loads(line)[key] for line in lines]
+                done.update(line.strip() for line in lines)
+        return done
+
+    checkpoint = checkpoint_path(output)
+    if os.path.exists(checkpoint) and os.path.exists(output):
+        done.update(line.strip() for line in _complete_lines(checkpoint))
+        return done
+    if os.path.exists(output):
+        with open(output, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                done.add(row[key])
+        with open(checkpoint, 'w', encoding='utf-8') as f:
+            for d in sorted(done):
+                f.write(d + '\n')
+    return done
+
+
+def load_rows(output, fmt='csv'):
+    """
+    Righe gia' scritte in `output` per chiave (la prima colonna), l'ultima
+    scritta per ogni chiave; {} se non c'e' ancora niente. Dal CSV i valori
+    arrivano come stringhe.
+    """
+    rows = {}
+    if fmt == 'parquet':
+        table = load_table(output) if os.path.isdir(parquet_path(output)) else None
+        if table is not None:
+            key = table.column_names[0]
+            for row in table.to_pylist():
+                rows[row[key]] = row
+        return rows
+    if os.path.exists(output):
+        with open(output, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                rows[row[reader.fieldnames[0]]] = row
+    return rows
+
+
+def _read_parts(path):
+    """Tutti i row group di una directory parquet, duplicati compresi; None se vuota."""
+    parts = sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+    if not parts:
+        return None
+    schema = pa.unify_schemas([pq.read_schema(p) for p in parts])
+    return ds.dataset(parts, schema=schema, format='parquet').to_table()
+
+
+def load_table(output):
+    """
+    Tabella arrow del dataset parquet di `output`, un riga per chiave (la
+    prima colonna; in caso di duplicati vince l'ultima scritta).
+    """
+    if pa is None:
+        sys.exit('load_table richiede pyarrow (pip install pyarrow)')
+    table = _read_parts(parquet_path(output))
+    return None if table is None else _last_per_key(table)
+
+
+def _last_per_key(table):
+    key = table.column_names[0]
+    table = table.append_column('_row', pa.array(range(table.num_rows), type=pa.int64()))
+    last = table.group_by(key).aggregate([('_row', 'max')])['_row_max']
+    keep = pc.take(last, pc.sort_indices(last))   # ordine di scrittura originale
+    return table.take(keep).drop_columns(['_row'])
+
+
+def compact(output):
+    """Riscrive il dataset in un solo file senza duplicati e rigenera l'indice."""
+    table = load_table(output)
+    if table is None:
+        return 0
+    _rewrite(parquet_path(output), table)
+    return table.num_rows
+
+
+def _rewrite(path, table):
+    """Sostituisce il contenuto della directory parquet `path` con `table`."""
+    os.makedirs(path, exist_ok=True)
+    first = os.path.join(path, 'part-000000.parquet')
+    old = [p for p in glob.glob(os.path.join(path, 'part-*.parquet')) if p != first]
+    # un crash a meta' lascia al massimo righe duplicate, che load_table scarta
+    pq.write_table(table, first + '.tmp')
+    os.replace(first + '.tmp', first)
+    for p in old:
+        os.remove(p)
+    with open(os.path.join(path, INDEX), 'w', encoding='utf-8') as f:
+        for d in table[table.column_names[0]].to_pylist():
+            f.write(d + '\n')
+
+
+def _shards(path):
+    """
+    File (o directory parquet) degli shard di `path`, dal meno al piu' recente.
+    Solo <nome>.shard-i-of-N<ext>: non i log accanto (..._concurrency.csv).
+    """
+    base, ext = os.path.splitext(path)
+    pattern = re.compile(r'\.shard-\d+-of-\d+' + re.escape(ext) + '$')
+    shards = [p for p in glob.glob(f'{glob.escape(base)}.shard-*-of-*{ext}')
+              if pattern.fullmatch(p[len(base):])]
+    return sorted(shards, key=os.path.getmtime)
+
+
+def _merge_csv(output, shards):
+    sources = ([output] if os.path.exists(output) else []) + shards
+    fieldnames, rows = [], {}
+    for path in sources:
+        with open(path, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            fieldnames += [c for c in reader.fieldnames or [] if c not in fieldnames]
+            for row in reader:
+                rows[row[fieldnames[0]]] = row
+    # stesso schema di compact: file nuovo completo, poi rename; infine il checkpoint
+    with open(output + '.tmp', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
+        writer.writeheader()
+        writer.writerows(rows.values())
+        _fsync(f)
+    os.replace(output + '.tmp', output)
+    with open(checkpoint_path(output), 'w', encoding='utf-8') as f:
+        for key in rows:
+            f.write(key + '\n')
+    return len(rows)
+
+
+def _merge_parquet(output, shards):
+    if pa is None:
+        sys.exit('merge di shard parquet richiede pyarrow (pip install pyarrow)')
+    path = parquet_path(output)
+    tables = [t for t in (_read_parts(p) for p in [path] + shards) if t is not None]
+    if not tables:
+        return 0
+    # colonne nell'ordine del primo (la chiave resta la prima), tipi unificati
+    table = _last_per_key(pa.concat_tables(tables, promote_options='default'))
+    _rewrite(path, table)
+    return table.num_rows
+
+
+def merge(output):
+    """
+    Riunisce gli shard di `output` (<nome>.shard-i-of-N.*, vedi domainlist)
+    nel file canonico, gia' esistente o no: una riga per chiave, e per i
+    domini presenti in piu' shard (N cambiato tra un giro e l'altro) vince
+    lo shard scritto per ultimo. Gli shard restano dove sono.
+    """
+    csv_shards = _shards(output)
+    if csv_shards:
+        n = _merge_csv(output, csv_shards)
+        print(f'{len(csv_shards)} shard -> {output} ({n} righe)')
+    parquet_shards = _shards(parquet_path(output))
+    if parquet_shards:
+        n = _merge_parquet(output, parquet_shards)
+        print(f'{len(parquet_shards)} shard -> {parquet_path(output)} ({n} righe)')
+    if not csv_shards and not parquet_shards:
+        print(f'{output}: nessuno shard')
+
+
+def _parse_csv_value(v):
+    """'True'/'False' -> bool, interi -> int, '' -> vuoto: i tipi persi dal CSV."""
+    if v in ('True', 'False'):
+        return v == 'True'
+    if v.lstrip('-').isdigit():
+        return int(v)
+    return v
+
+
+def convert(output):
+    """Converte il CSV storico di uno scanner nel dataset parquet tipizzato."""
+    with open(output, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = [{k: _parse_csv_value(v or '') for k, v in row.items()} for row in reader]
+    sink = ParquetStore(output, fieldnames, key=fieldnames[0])
+    sink.append(rows)
+    sink.close()
+    return len(rows)
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('convert', 'compact', 'merge'):
+        sys.exit(__doc__)
+    command = {'convert': convert, 'compact': compact, 'merge': merge}[sys.argv[1]]
+    for output in sys.argv[2:]:
+        n = command(output)
+        if n is not None:
+            print(f'{output} -> {parquet_path(output)} ({n} righe)')
+
+
+if __name__ == '__main__':
+    main()
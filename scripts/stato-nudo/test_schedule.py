@@ -0,0 +1,57 @@
+"""Test di schedule.State: prossima scansione da intervallo, TTL ed errori."""
+
+import time
+
+import schedule
+
+ROW = {'domain': 'comune.it', 'has_spf': True, 'error': ''}
+
+
+def _next(state, ttl=0, row=ROW):
+    state.record('dns', row, ttl)
+    delay, reason = state.conn.execute(
+        'SELECT next_scan - last_scan, reason FROM state WHERE domain = ?', (row['domain'],)
+    ).fetchone()
+    return round(delay), reason
+
+
+def test_lapsed_ttl_triggers_earlier_rescan(tmp_path):
+    state = schedule.State(str(tmp_path / 'state.sqlite'))
+    delay, reason = _next(state, ttl=3 * schedule.DAY)
+    assert reason == 'ttl'
+    assert delay == 3 * schedule.DAY
+
+
+def test_short_ttl_is_floored_at_min_age(tmp_path):
+    state = schedule.State(str(tmp_path / 'state.sqlite'))
+    delay, reason = _next(state, ttl=300)
+    assert reason == 'ttl'
+    assert delay == schedule.TTL_MIN_AGE
+
+
+def test_ttl_longer_than_interval_does_not_delay(tmp_path):
+    state = schedule.State(str(tmp_path / 'state.sqlite'))
+    delay, reason = _next(state, ttl=30 * schedule.DAY)
+    assert reason == 'eta'
+    assert delay == schedule.BASE_AGE
+
+
+def test_no_ttl_uses_interval(tmp_path):
+    state = schedule.State(str(tmp_path / 'state.sqlite'))
+    assert _next(state) == (schedule.BASE_AGE, 'eta')
+
+
+def test_error_retried_before_ttl(tmp_path):
+    state = schedule.State(str(tmp_path / 'state.sqlite'))
+    row = dict(ROW, error='timeout')
+    assert _next(state, ttl=300, row=row) == (schedule.ERROR_RETRY, 'errore')
+
+
+def test_due_after_ttl_lapses(tmp_path, monkeypatch):
+    state = schedule.State(str(tmp_path / 'state.sqlite'))
+    state.record('dns', ROW, ttl=2 * schedule.DAY)
+    later = time.time() + 2 * schedule.DAY + 1
+    monkeypatch.setattr(schedule.time, 'time', lambda: later)
+    due, reasons = state.due('dns', ['comune.it', 'altro.it'], str(tmp_path / 'dns.csv'))
+    assert due == ['comune.it']
+    assert reasons == {'ttl': 1}
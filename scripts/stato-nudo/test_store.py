@@ -0,0 +1,105 @@
+"""
+Test di store: merge di shard scritti da engine.run (con i loro log di
+concorrenza accanto) e WAL di ParquetStore con valori fuori tipo.
+"""
+
+import csv
+import json
+import os
+
+import pytest
+
+import domainlist
+import engine
+import store
+
+FIELDNAMES = ['domain', 'status', 'error']
+
+
+def _scan(domain):
+    return {'domain': domain, 'status': 'ok', 'error': ''}
+
+
+def _run_shards(output, domains, n, fmt='csv'):
+    for i in range(1, n + 1):
+        todo = [d for d in domains if domainlist.shard_of(d, n) == i]
+        engine.run(todo, _scan, domainlist.shard_path(output, (i, n)), FIELDNAMES,
+                   workers=2, fmt=fmt)
+
+
+def test_merge_csv_ignores_concurrency_logs(tmp_path):
+    output = str(tmp_path / 'tls_results.csv')
+    domains = [f'comune{i}.it' for i in range(40)]
+    _run_shards(output, domains, 2)
+    logs = [p for p in os.listdir(tmp_path) if p.endswith('_concurrency.csv')]
+    assert len(logs) == 2
+
+    shards = store._shards(output)
+    assert [os.path.basename(p) for p in sorted(shards)] == [
+        'tls_results.shard-1-of-2.csv', 'tls_results.shard-2-of-2.csv']
+
+    store.merge(output)
+    with open(output, 'r', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(r['domain'] for r in rows) == sorted(domains)
+    assert list(rows[0]) == FIELDNAMES
+
+
+def test_merge_parquet_ignores_concurrency_logs(tmp_path):
+    pytest.importorskip('pyarrow')
+    output = str(tmp_path / 'tls_results.csv')
+    domains = [f'comune{i}.it' for i in range(40)]
+    _run_shards(output, domains, 2, fmt='parquet')
+
+    store.merge(output)
+    table = store.load_table(output)
+    assert sorted(table.column('domain').to_pylist()) == sorted(domains)
+
+
+def test_parquet_oversized_int_is_reported_not_fatal(tmp_path):
+    pytest.importorskip('pyarrow')
+    output = str(tmp_path / 'dns_extra_results.csv')
+    fields = ['domain', 'spf_ip6_64_count', 'error']
+    sink = store.ParquetStore(output, fields)
+    sink.write({'domain': 'a.it', 'spf_ip6_64_count': 5, 'error': ''})
+    sink.write({'domain': 'b.it', 'spf_ip6_64_count': 2 ** 64, 'error': ''})
+    sink.close()
+
+    rows = {r['domain']: r for r in store.load_table(output).to_pylist()}
+    assert rows['a.it']['spf_ip6_64_count'] == 5
+    assert rows['b.it']['spf_ip6_64_count'] is None
+    assert 'spf_ip6_64_count' in rows['b.it']['error']
+
+
+def test_parquet_first_oversized_int_widens_to_float(tmp_path):
+    pytest.importorskip('pyarrow')
+    output = str(tmp_path / 'dns_extra_results.csv')
+    sink = store.ParquetStore(output, ['domain', 'n'])
+    sink.write({'domain': 'a.it', 'n': 2 ** 64})
+    sink.write({'domain': 'b.it', 'n': 3})
+    sink.close()
+    assert store.load_table(output).column('n').to_pylist() == [2.0 ** 64, 3.0]
+
+
+def test_parquet_reopens_with_poisoned_wal(tmp_path):
+    pytest.importorskip('pyarrow')
+    output = str(tmp_path / 'dns_extra_results.csv')
+    fields = ['domain', 'n', 'error']
+    sink = store.ParquetStore(output, fields)
+    sink.write({'domain': 'a.it', 'n': 1, 'error': ''})
+    sink.sync()                  # niente close: la riga resta nel WAL, come dopo un crash
+    # righe scritte nel WAL da una versione senza controllo dei tipi
+    path = store.parquet_path(output)
+    with open(os.path.join(path, store.PENDING), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'domain': 'b.it', 'n': 2 ** 70, 'error': ''}) + '\n')
+        f.write('{"domain": "c.it", \n')
+
+    reopened = store.ParquetStore(output, fields)
+    reopened.write({'domain': 'd.it', 'n': 4, 'error': ''})
+    reopened.close()
+
+    rows = {r['domain']: r for r in store.load_table(output).to_pylist()}
+    assert sorted(rows) == ['a.it', 'b.it', 'd.it']
+    assert rows['b.it']['n'] is None and rows['b.it']['error']
+    with open(os.path.join(path, store.REJECTED), 'r', encoding='utf-8') as f:
+        assert 'c.it' in f.read()
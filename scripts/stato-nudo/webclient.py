@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Client HTTP per scan_headers: una Session per dominio, con il minimo di
+connessioni.
+- keep-alive: una connessione per (schema, host, porta), riusata dalle
+  richieste successive verso lo stesso host
+- redirect seguiti fino a REDIRECTS, registrando ogni tappa (status, url)
+- un url gia' richiesto nella sessione non viene richiesto di nuovo: la
+  catena http://d/ -> https://d/ si chiude sulla HEAD HTTPS gia' fatta
+- HTTP/2 se il server lo sceglie via ALPN (offerto da probes solo se e'
+  installato h2: pip install h2), altrimenti HTTP/1.1
+Le connessioni https passano da probes.connect(): le sessioni TLS si riprendono.
+"""
+
+import http.client
+import socket
+import threading
+import urllib.parse
+
+import probes
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+
+# --- Configurazione ---
+REDIRECTS  = 10          # come urllib
+USER_AGENT = 'Mozilla/5.0 (security-research)'
+# ----------------------
+
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+_lock = threading.Lock()
+_counts = {'requests': 0, 'connections': 0, 'cached': 0}
+
+
+def _count(name):
+    with _lock:
+        _counts[name] += 1
+
+
+class _Http1:
+    """Connessione HTTP/1.1 keep-alive (http.client) su un socket gia' aperto."""
+
+    version = 'HTTP/1.1'
+
+    def __init__(self, sock, host, port, timeout, tls):
+        if tls:
+            self.conn = http.client.HTTPSConnection(host, port, timeout=timeout,
+                                                    context=probes.context())
+        else:
+            self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.conn.sock = sock
+        self.tls = tls
+        self.closed = False
+
+    def head(self, host, path):
+        sock = self.conn.sock
+        self.conn.request('HEAD', path, headers={'User-Agent': USER_AGENT})
+        resp = self.conn.getresponse()
+        if self.tls:
+            # risposta letta: con TLS 1.3 ora la sessione ha il ticket
+            probes.save_session(sock, host, self.conn.port)
+        resp.close()
+        if resp.will_close:
+            self.closed = True
+        return resp.status, resp.reason, resp.headers
+
+
+class _Http2:
+    """Connessione HTTP/2 (h2): una richiesta per stream, tutte sullo stesso socket."""
+
+    version = 'HTTP/2'
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=True, header_encoding='utf-8'))
+        self.conn.initiate_connection()
+        self.sock.sendall(self.conn.data_to_send())
+        self.closed = False
+
+    def head(self, host, path):
+        stream = self.conn.get_next_available_stream_id()
+        self.conn.send_headers(stream, [
+            (':method', 'HEAD'), (':scheme', 'https'), (':authority', host),
+            (':path', path), ('user-agent', USER_AGENT),
+        ], end_stream=True)
+        self.sock.sendall(self.conn.data_to_send())
+
+        fields, ended = None, False
+        while not ended:
+            data = self.sock.recv(65535)
+            if not data:
+                self.closed = True
+                raise http.client.RemoteDisconnected('connessione HTTP/2 chiusa dal server')
+            for event in self.conn.receive_data(data):
+                if isinstance(event, h2.events.ResponseReceived) and event.stream_id == stream:
+                    fields = event.headers
+                elif isinstance(event, h2.events.StreamEnded) and event.stream_id == stream:
+                    ended = True
+                elif isinstance(event, h2.events.StreamReset) and event.stream_id == stream:
+                    raise http.client.HTTPException(f'stream HTTP/2 annullato ({event.error_code})')
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    self.closed = True
+                    if not ended:
+                        raise http.client.HTTPException(f'connessione HTTP/2 terminata ({event.error_code})')
+            pending = self.conn.data_to_send()
+            if pending:
+                self.sock.sendall(pending)
+        if fields is None:
+            raise http.client.HTTPException('risposta HTTP/2 senza intestazioni')
+
+        headers = http.client.HTTPMessage()
+        status = 0
+        for name, value in fields:
+            if name == ':status':
+                status = int(value)
+            elif not name.startswith(':'):
+                headers[name] = value
+        return status, http.client.responses.get(status, ''), headers
+
+
+class Session:
+    """Connessioni e risposte di una scansione; va chiusa con close()."""
+
+    def __init__(self, timeout, redirects=REDIRECTS):
+        self.timeout = timeout
+        self.redirects = redirects
+        self.conns = {}          # (schema, host, porta) -> _Http1 / _Http2
+        self.responses = {}      # url -> (status, reason, headers, versione)
+
+    def _wrap(self, sock, scheme, host, port):
+        if scheme == 'https':
+            if h2 is not None and sock.selected_alpn_protocol() == 'h2':
+                return _Http2(sock)
+            return _Http1(sock, host, port, self.timeout, tls=True)
+        return _Http1(sock, host, port, self.timeout, tls=False)
+
+    def adopt(self, ssock, host, port=443):
+        """Usa una connessione TLS gia' aperta (probes.tls_handshake(keep=True))."""
+        self.conns[('https', host, port)] = self._wrap(ssock, 'https', host, port)
+
+    def _open(self, scheme, host, port):
+        if scheme == 'https':
+            sock = probes.connect(host, self.timeout, port)
+        else:
+            sock = socket.create_connection((host, port), timeout=self.timeout)
+        _count('connections')
+        return self._wrap(sock, scheme, host, port)
+
+    def _request(self, url):
+        parts = urllib.parse.urlsplit(url)
+        scheme, host = parts.scheme, parts.hostname
+        port = parts.port or (443 if scheme == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        key = (scheme, host, port)
+        conn = self.conns.get(key)
+        reused = conn is not None
+        if conn is None:
+            conn = self.conns[key] = self._open(scheme, host, port)
+        try:
+            status, reason, headers = conn.head(host, path)
+        except (http.client.RemoteDisconnected, ConnectionError):
+            self._drop(key)
+            if not reused:
+                raise
+            # keep-alive scaduto lato server: una sola riprova su una connessione nuova
+            conn = self.conns[key] = self._open(scheme, host, port)
+            status, reason, headers = conn.head(host, path)
+        except Exception:
+            self._drop(key)
+            raise
+        _count('requests')
+        if conn.closed:
+            self._drop(key)
+        return status, reason, headers, conn.version
+
+    def _drop(self, key):
+        conn = self.conns.pop(key, None)
+        if conn is not None:
+            self._close(key, conn)
+
+    def _close(self, key, conn):
+        sock = conn.sock if isinstance(conn, _Http2) else conn.conn.sock
+        if sock is None:
+            return
+        if key[0] == 'https':
+            probes.close(sock, key[1], key[2])   # tiene la sessione TLS
+        else:
+            sock.close()
+
+    def head(self, url):
+        """
+        HEAD a url seguendo i redirect. Ritorna (status, reason, headers,
+        url finale, versione HTTP, tappe), con tappe = [(status, url), ...].
+        """
+        hops = []
+        for _ in range(self.redirects + 1):
+            if url in self.responses:
+                _count('cached')
+            else:
+                self.responses[url] = self._request(url)
+            status, reason, headers, version = self.responses[url]
+            hops.append((status, url))
+            location = headers.get('Location')
+            if status in REDIRECT_STATUS and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return status, reason, headers, url, version, hops
+        raise http.client.HTTPException(f'troppi redirect ({self.redirects})')
+
+    def close(self):
+        for key in list(self.conns):
+            self._drop(key)
+
+
+def format_hops(hops):
+    """[(301, 'http://x/'), (200, 'https://x/')] -> '301 http://x/ > 200 https://x/'"""
+    return ' > '.join(f'{status} {url}' for status, url in hops)
+
+
+def stats():
+    return (f"richieste HTTP/connessioni/da cache: "
+            f"{_counts['requests']}/{_counts['connections']}/{_counts['cached']}")